@@ -0,0 +1,316 @@
+#! /usr/bin/python3
+
+# Youtube-downloader
+#
+# Benchmarks of the download pipeline against a local stand-in server.
+# Every flow runs in its own process, so the peak memory use is measured
+# per flow. The results are printed as JSON, for tracking over time.
+#
+#   python3 benchmarks/run.py                  all flows
+#   python3 benchmarks/run.py file spotify     some flows
+#   python3 benchmarks/run.py --output results.json
+#
+# The transcode flows need moviepy and numpy to generate an audio track,
+# stream_transcode needs ffmpeg too.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from server import PLAYER_RESPONSE_REGEX, StandInServer
+from urllib.parse import urlencode
+import argparse
+import collections
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import Downloader, convert_to_mp3, ffmpeg_executable, transcode_stream, youtube_video_id  # noqa: E402
+from matching import parse_duration, score  # noqa: E402
+from progress import ProgressBus  # noqa: E402
+import media  # noqa: E402
+import network  # noqa: E402
+
+FLOWS = ('single', 'file', 'spotify', 'transcode', 'stream_transcode', 'startup', 'overhead')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_CODE = "import time; started = time.perf_counter(); import engine, jobs, youtube_downloader; print(time.perf_counter() - started)"
+MB = 1024 * 1024
+
+Stream = collections.namedtuple('Stream', 'url filesize default_filename')
+
+
+class MeasuringBus(ProgressBus):
+    """ProgressBus that measures the time to the first byte and the number of bytes received."""
+
+    def __init__(self):
+        super(MeasuringBus, self).__init__()
+        self.started = time.monotonic()
+        self.first_byte = None
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def publish(self, kind, value=None):
+        if kind == 'bytes':
+            with self._lock:
+                if self.first_byte is None:
+                    self.first_byte = time.monotonic() - self.started
+                self.bytes_received += value
+
+
+class BenchmarkDownloader(Downloader):
+    """
+    Downloader that gets its metadata and search results from the stand-in
+    server instead of YouTube. Everything else is the real pipeline,
+    including the rate limits of the scheduler.
+    """
+
+    def __init__(self, server_url, *args, **kwargs):
+        super(BenchmarkDownloader, self).__init__(*args, **kwargs)
+        self.server_url = server_url
+
+    def get(self, path):
+        with network.session().request('GET', self.server_url + path) as response:
+            return response.read().decode()
+
+    def select_stream(self, video_id):
+        page = self.get(f'/watch?v={video_id}')
+        player = json.loads(PLAYER_RESPONSE_REGEX.search(page).group(1))
+        if player['playabilityStatus']['status'] != 'OK':
+            return None
+        stream = player['streamingData']['formats'][0]
+        return Stream(stream['url'], int(stream['contentLength']), f"{player['videoDetails']['title']}.mp4")
+
+    def search_youtube(self, query):
+        return json.loads(self.get('/search?' + urlencode({'q': query})))
+
+    def video_durations(self, video_ids):
+        items = json.loads(self.get('/videos?' + urlencode({'id': ','.join(video_ids)})))['items']
+        return {item['id']: parse_duration(item['contentDetails']['duration']) for item in items}
+
+
+def peak_rss():
+    """Peak memory use of this process and its finished children, in MB."""
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return usage / MB if sys.platform == 'darwin' else usage / 1024  # Bytes on macOS, kB elsewhere
+
+
+def download_flow(args, target, flow):
+    """Run the single, file or spotify flow. Streams are downloaded as mp4, so nothing is transcoded."""
+    server = StandInServer(args.stream_size * MB, args.tracks, args.latency / 1000).start()
+    if flow == 'single':
+        server.stream_size = args.single_size * MB
+
+    bus = MeasuringBus()
+    with BenchmarkDownloader(server.url, target, True, args.jobs, bus=bus) as downloader:
+        if flow == 'single':
+            items = int(downloader.download_url('https://www.youtube.com/watch?v=single00001') == 'downloaded')
+        elif flow == 'file':
+            # Every tenth video is listed twice, every twentieth is unavailable
+            urls = [f'https://youtu.be/{"gone" if number % 20 == 19 else "file"}{number:07d}' for number in range(args.items)]
+            urls += urls[::10]
+            items = downloader.download_urls(urls)['downloaded']
+        else:
+            import spotipy
+            spotify = spotipy.Spotify(auth='benchmark')
+            spotify.prefix = f'{server.url}/v1/'
+            playlist = spotify.playlist('benchmark', fields='id,tracks(total)')
+            items = downloader.download_playlist(spotify, playlist)['downloaded']
+    seconds = time.monotonic() - bus.started
+    server.shutdown()
+
+    return {
+        'flow': flow,
+        'items': items,
+        'seconds': round(seconds, 3),
+        'items_per_second': round(items / seconds, 3),
+        'bytes': bus.bytes_received,
+        'bytes_per_second': round(bus.bytes_received / seconds),
+        'ttfb_seconds': None if bus.first_byte is None else round(bus.first_byte, 3),
+        'peak_rss_mb': round(peak_rss(), 1),
+    }
+
+
+def audio_track(args, target):
+    """Generate an aac track of a tone in target, args.audio_seconds long. Returns its path."""
+    from moviepy.audio.AudioClip import AudioClip
+    import numpy
+
+    def make_frame(t):
+        tone = numpy.sin(2 * numpy.pi * 440 * t)
+        return numpy.array([tone, tone]).T
+
+    path = os.path.join(target, 'transcode.mp4')
+    clip = AudioClip(make_frame, duration=args.audio_seconds, fps=44100)
+    clip.write_audiofile(path, fps=44100, codec='aac', logger=None)
+    return path
+
+
+def transcode_flow(args, target):
+    """Convert a generated audio track to mp3 with convert_to_mp3, like the moviepy backend."""
+    path = audio_track(args, target)
+    started = time.monotonic()
+    convert_to_mp3(path)
+    seconds = time.monotonic() - started
+    return {
+        'flow': 'transcode',
+        'audio_minutes': args.audio_seconds / 60,
+        'seconds': round(seconds, 3),
+        'seconds_per_audio_minute': round(seconds / (args.audio_seconds / 60), 3),
+        'peak_rss_mb': round(peak_rss(), 1),
+    }
+
+
+def stream_transcode_flow(args, target):
+    """
+    Download a generated audio track from the stand-in server and encode it
+    to mp3 with ffmpeg while it downloads, like the default ffmpeg backend.
+    """
+    ffmpeg = ffmpeg_executable()
+    if ffmpeg is None:
+        raise SystemExit("ffmpeg not found")
+    with open(audio_track(args, target), 'rb') as file:
+        server = StandInServer(media=file.read()).start()
+
+    bus = MeasuringBus()
+    transcode_stream(ffmpeg, f'{server.url}/stream/transcode', os.path.join(target, 'transcode.mp3'), len(server.media),
+                     on_progress=lambda size: bus.publish('bytes', size))
+    seconds = time.monotonic() - bus.started
+    server.shutdown()
+    return {
+        'flow': 'stream_transcode',
+        'audio_minutes': args.audio_seconds / 60,
+        'seconds': round(seconds, 3),
+        'seconds_per_audio_minute': round(seconds / (args.audio_seconds / 60), 3),
+        'bytes': bus.bytes_received,
+        'ttfb_seconds': None if bus.first_byte is None else round(bus.first_byte, 3),
+        'peak_rss_mb': round(peak_rss(), 1),
+    }
+
+
+def startup_flow(args, target):
+    """Time to import the downloader and to show the command line help in a new interpreter, median of several runs."""
+    imports = []
+    help_runs = []
+    for _ in range(args.runs):
+        child = subprocess.run([sys.executable, '-c', IMPORT_CODE], cwd=ROOT, stdout=subprocess.PIPE,
+                               universal_newlines=True, check=True)
+        imports.append(float(child.stdout))
+        started = time.monotonic()
+        subprocess.run([sys.executable, os.path.join(ROOT, 'youtube_downloader.py'), 'batch', '--help'],
+                       stdout=subprocess.DEVNULL, check=True)
+        help_runs.append(time.monotonic() - started)
+    return {
+        'flow': 'startup',
+        'import_seconds': round(sorted(imports)[len(imports) // 2], 4),
+        'cli_help_seconds': round(sorted(help_runs)[len(help_runs) // 2], 4),
+        'peak_rss_mb': round(peak_rss(), 1),
+    }
+
+
+def overhead_flow(args, target):
+    """Fixed cost per item of the URL check, the media type check and the scoring of a search result, in microseconds."""
+    path = os.path.join(target, 'header.m4a')
+    with open(path, 'wb') as file:
+        file.write(b'\x00\x00\x00\x18ftypM4A \x00\x00\x02\x00' + bytes(1024))
+    track = {'name': 'Song Title', 'artists': [{'name': 'Artist'}], 'duration_ms': 210000}
+    result = {'video_id': 'abcdefghijk', 'video_title': 'Artist - Song Title (Official Video)', 'channel_title': 'Artist - Topic'}
+
+    def per_item(function, *arguments):
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            function(*arguments)
+        return round((time.perf_counter() - started) / args.iterations * 1e6, 2)
+
+    return {
+        'flow': 'overhead',
+        'validate_us': per_item(youtube_video_id, 'https://www.youtube.com/watch?v=abcdefghijk'),
+        'mime_us': per_item(media.is_media, path),
+        'score_us': per_item(score, track, result, 210),
+        'peak_rss_mb': round(peak_rss(), 1),
+    }
+
+
+def run_flow(args, flow):
+    """Run one flow in this process, in a temporary target and cache directory."""
+    target = tempfile.mkdtemp(prefix='youtube_downloader_benchmark_')
+    os.environ['XDG_CACHE_HOME'] = target  # Start without cached resolutions
+    try:
+        if flow == 'transcode':
+            return transcode_flow(args, target)
+        if flow == 'stream_transcode':
+            return stream_transcode_flow(args, target)
+        if flow == 'startup':
+            return startup_flow(args, target)
+        if flow == 'overhead':
+            return overhead_flow(args, target)
+        return download_flow(args, target, flow)
+    finally:
+        shutil.rmtree(target)
+
+
+def parse_args(argv):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark the download pipeline against a local stand-in server.")
+    parser.add_argument('flows', nargs='*', default=FLOWS, help=f"flows to run: {', '.join(FLOWS)} (default: all)")
+    parser.add_argument('--jobs', type=int, default=4, help="number of parallel downloads (default: 4)")
+    parser.add_argument('--items', type=int, default=200, help="URLs in the file flow (default: 200)")
+    parser.add_argument('--tracks', type=int, default=50, help="tracks in the spotify flow (default: 50)")
+    parser.add_argument('--stream-size', type=int, default=4, help="average stream size in MB (default: 4)")
+    parser.add_argument('--single-size', type=int, default=128, help="stream size in MB of the single flow (default: 128)")
+    parser.add_argument('--latency', type=float, default=50, help="latency of metadata requests in ms (default: 50)")
+    parser.add_argument('--audio-seconds', type=int, default=180, help="audio length of the transcode flows (default: 180)")
+    parser.add_argument('--runs', type=int, default=5, help="interpreter starts in the startup flow (default: 5)")
+    parser.add_argument('--iterations', type=int, default=10000, help="calls per check in the overhead flow (default: 10000)")
+    parser.add_argument('--output', help="write the results to this file instead of stdout")
+    parser.add_argument('--in-process', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    for flow in args.flows:
+        if flow not in FLOWS:
+            parser.error(f"unknown flow: {flow}")
+    return args
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    if args.in_process:
+        print(json.dumps(run_flow(args, args.flows[0])))
+        return 0
+
+    options = [option for option in argv if option not in FLOWS]
+    results = []
+    for flow in args.flows:
+        print(f"Running {flow}...", file=sys.stderr)
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), flow, '--in-process'] + options,
+                               stdout=subprocess.PIPE, universal_newlines=True)
+        if child.returncode != 0:
+            results.append({'flow': flow, 'error': f"exit status {child.returncode}"})
+        else:
+            results.append(json.loads(child.stdout))
+
+    report = json.dumps({
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('flows', 'output', 'in_process')},
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
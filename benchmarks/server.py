@@ -0,0 +1,174 @@
+# Youtube-downloader
+#
+# Local stand-in for YouTube and Spotify, used by the benchmarks.
+# It serves synthetic or given media streams with HTTP Range support, fake watch
+# pages, fake search and video duration endpoints and a fake Spotify
+# playlist_items endpoint.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+BLOCK = os.urandom(1024 * 1024)  # Stream data is this block repeated
+PLAYER_RESPONSE_REGEX = re.compile(r'var ytInitialPlayerResponse = (\{.*?\});</script>')
+
+
+def stream_size(video_id, average_size):
+    """Size of the stream of a video: between half and one and a half times the average."""
+    return average_size * (50 + zlib.crc32(video_id.encode()) % 100) // 100
+
+
+def stream_data(start, end):
+    """Yield the synthetic stream bytes start to end (inclusive) in blocks."""
+    position = start
+    while position <= end:
+        offset = position % len(BLOCK)
+        data = BLOCK[offset:offset + end + 1 - position]
+        yield data
+        position += len(data)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Request handler of the stand-in server. Settings are on self.server."""
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real servers
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        routes = [
+            (r'/stream/([\w\-]+)$', self.stream),
+            (r'/watch$', self.watch),
+            (r'/search$', self.search),
+            (r'/videos$', self.videos),
+            (r'/v1/playlists/([\w\-]+)/(?:tracks|items)$', self.playlist_items),
+            (r'/v1/playlists/([\w\-]+)$', self.playlist),
+        ]
+        for pattern, route in routes:
+            match = re.match(pattern, url.path)
+            if match:
+                return route(query, *match.groups())
+        self.send_error(404)
+
+    def send_json(self, value):
+        self.send_body(json.dumps(value).encode(), 'application/json')
+
+    def send_body(self, body, content_type):
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, query, video_id):
+        """Synthetic media stream, or the media of the server, with support for Range requests."""
+        media = self.server.media
+        size = len(media) if media is not None else stream_size(video_id, self.server.stream_size)
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match is None:
+            start, end = 0, size - 1
+            self.send_response(200)
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or size - 1), size - 1)
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.end_headers()
+        for data in [media[start:end + 1]] if media is not None else stream_data(start, end):
+            self.wfile.write(data)
+
+    def watch(self, query):
+        """
+        Watch page with the player response embedded, like YouTube's.
+        Videos with an id starting with 'gone' are unavailable.
+        """
+        video_id = query['v']
+        if video_id.startswith('gone'):
+            response = {'playabilityStatus': {'status': 'ERROR', 'reason': 'Video unavailable'}}
+        else:
+            response = {
+                'playabilityStatus': {'status': 'OK'},
+                'videoDetails': {'videoId': video_id, 'title': f'Video {video_id}'},
+                'streamingData': {'formats': [{
+                    'itag': 18,
+                    'url': f'{self.server.url}/stream/{video_id}',
+                    'mimeType': 'video/mp4; codecs="avc1.42001E, mp4a.40.2"',
+                    'contentLength': str(stream_size(video_id, self.server.stream_size)),
+                }]},
+            }
+        padding = '<div></div>' * 5000  # Real watch pages are several hundred kB
+        page = f'<html><body>{padding}<script>var ytInitialPlayerResponse = {json.dumps(response)};</script></body></html>'
+        self.send_body(page.encode(), 'text/html')
+
+    def search(self, query):
+        """Search results in the format of youtube_api: the first result matches the query."""
+        video_id = 'v' + format(zlib.crc32(query['q'].encode()), '010x')
+        self.send_json([
+            {'video_id': 'live' + video_id, 'video_title': f"{query['q']} (Live)", 'channel_title': 'Fan uploads'},
+            {'video_id': video_id, 'video_title': query['q'], 'channel_title': 'Artist - Topic'},
+            {'video_id': 'gone' + video_id, 'video_title': 'Something else', 'channel_title': 'Other'},
+        ])
+
+    def videos(self, query):
+        """Durations of videos, like the videos endpoint of the YouTube Data API with part=contentDetails."""
+        self.send_json({'items': [
+            {'id': video_id, 'contentDetails': {'duration': 'PT3M30S'}} for video_id in query['id'].split(',')
+        ]})
+
+    def playlist(self, query, playlist_id):
+        self.send_json({'id': playlist_id, 'tracks': {'total': self.server.tracks}})
+
+    def playlist_items(self, query, playlist_id):
+        """A page of the playlist, tracks are named after their position."""
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 100))
+        end = min(offset + limit, self.server.tracks)
+        items = [
+            {'track': {'id': f'track{number}', 'name': f'Track {number}', 'duration_ms': 210000, 'artists': [{'name': 'Artist'}]}}
+            for number in range(offset, end)
+        ]
+        next_url = None
+        if end < self.server.tracks:
+            next_url = f'{self.server.url}/v1/playlists/{playlist_id}/tracks?offset={end}&limit={limit}'
+        self.send_json({'items': items, 'next': next_url, 'total': self.server.tracks})
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    The stand-in server, serving on a free port of localhost in a daemon thread.
+    Every response except stream data is delayed by latency seconds.
+    When media is given, every stream serves these bytes instead of synthetic data.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, stream_size=8 * 1024 * 1024, tracks=50, latency=0.05, media=None):
+        super(StandInServer, self).__init__(('127.0.0.1', 0), Handler)
+        self.stream_size = stream_size
+        self.media = media
+        self.tracks = tracks
+        self.latency = latency
+        self.url = f'http://127.0.0.1:{self.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="Server", daemon=True).start()
+        return self
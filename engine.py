@@ -0,0 +1,750 @@
+# Youtube-downloader
+#
+# Download engine without GUI, used by both the GUI pages and the command line.
+# Heavy libraries (pytube, moviepy, spotipy, youtube_api, multiprocessing for
+# the Transcoder and the asyncio pipeline for Spotify playlists) are imported
+# when they are first needed, so starting the downloader stays fast.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from concurrent.futures import ThreadPoolExecutor
+from matching import parse_duration
+from media import is_media
+from metrics import measured, metrics
+from network import DownloadCancelled, copy_url, download_file, install_pytube_transport, session
+from output import OutputDirectory
+from progress import SilentBus
+from scheduler import Scheduler, is_fatal, is_transient
+from storage import DownloadIndex, ResolutionCache
+import collections
+import functools
+import heapq
+import os
+import queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+
+SEGMENT_THRESHOLD = 64 * 1024 * 1024  # Streams larger than this are downloaded in parallel segments
+SEGMENTS = 4
+RESULTS_SIZE = 10000  # Number of recent download results remembered by a Downloader
+PREFETCH_SIZE = 256  # Videos resolved ahead of the downloads, stream urls expire after a few hours
+REQUEUES = 2  # Times an item that failed with a transient error is queued again
+DURATIONS_BATCH = 50  # Video ids per videos.list call of the YouTube Data API, its maximum
+PAGE_SIZE = 100  # Tracks per page of a Spotify playlist, the maximum of the API
+YOUTUBE_REGEX = re.compile(r"^((?:https?:)?\/\/)?((?:www|m)\.)?((?:youtube\.com|youtu.be))(\/(?:[\w\-]+\?v=|embed\/|v\/)?)([\w\-]+)(\S+)?$")
+NUMBER_REGEX = re.compile(r'\d+')
+
+
+def youtube_video_id(url):
+    """Extract the video id from a YouTube URL, returns None for other URLs."""
+    match = YOUTUBE_REGEX.match(url)
+    return match.group(5) if match else None
+
+
+def convert_to_mp3(media_path, mp3_path=None):
+    """
+    Convert a downloaded audio or video file to an mp3 audio file.
+    Only the audio track is decoded, video frames are never touched.
+    This is a module level function so it can run in a Transcoder process.
+
+    The mp3 file is written next to the media file. When mp3_path is given
+    it is moved there once it is complete, and a media file that cannot be
+    converted is removed. Returns the path of the mp3 file, or None if the
+    file was not converted.
+    """
+    with metrics.span('mime'):
+        convertible = is_media(media_path)
+    if not convertible:
+        if mp3_path is not None:
+            os.remove(media_path)
+        return None
+
+    from moviepy.audio.io.AudioFileClip import AudioFileClip
+
+    converted = os.path.splitext(media_path)[0] + ".mp3"
+    with metrics.span('transcode'):
+        audioclip = AudioFileClip(media_path)
+        audioclip.write_audiofile(converted)
+        audioclip.close()
+    os.remove(media_path)
+    if mp3_path is None:
+        return converted
+    os.replace(converted, mp3_path)
+    return mp3_path
+
+
+class TranscodeError(Exception):
+    """Raised when ffmpeg fails to convert a stream."""
+
+
+def ffmpeg_executable():
+    """Return the path of ffmpeg: the one of imageio-ffmpeg (installed with moviepy), or the one on the PATH."""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return shutil.which('ffmpeg')
+
+
+def transcode_stream(ffmpeg, url, mp3_path, filesize=None, stopped=None, on_progress=None, part=None):
+    """
+    Download a stream straight into an ffmpeg process that encodes it to mp3,
+    so the audio is converted while it downloads and the source is never
+    written to disk. The mp3 is written to part (default mp3_path + '.part')
+    and moved to mp3_path when it is complete. Unlike download_file this
+    cannot be resumed: a stopped download raises DownloadCancelled and leaves
+    nothing behind.
+    """
+    part = part or mp3_path + '.part'
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-i', 'pipe:0', '-vn', '-f', 'mp3', part],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=errors)
+        try:
+            try:
+                copy_url(url, process.stdin, 0, filesize, stopped, on_progress)
+                process.stdin.close()
+            except BrokenPipeError:
+                pass  # ffmpeg stopped reading, its exit status tells why
+            if process.wait() != 0:
+                errors.seek(0)
+                raise TranscodeError(errors.read().decode(errors='replace').strip())
+        except BaseException:
+            process.kill()
+            process.wait()
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+    os.replace(part, mp3_path)
+    return mp3_path
+
+
+def mux_streams(ffmpeg, video_path, audio_path, output_path, part=None):
+    """
+    Combine a video-only and an audio-only file into an mp4 file, copying the
+    streams without encoding them again. The file is written to part (default
+    output_path + '.part') and moved to output_path when it is complete.
+    The input files are removed afterwards.
+    """
+    part = part or output_path + '.part'
+    result = subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-i', video_path, '-i', audio_path,
+         '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-f', 'mp4', part],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        if os.path.exists(part):
+            os.remove(part)
+        raise TranscodeError(result.stderr.decode(errors='replace').strip())
+    os.replace(part, output_path)
+    os.remove(video_path)
+    os.remove(audio_path)
+    return output_path
+
+
+def read_urls(filename):
+    """
+    Read a file with one URL per line. The file is read lazily, so files
+    of any length are processed in constant memory. Empty lines are skipped.
+    """
+    with open(filename, 'r') as urls_file:
+        for line in urls_file:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def count_urls(filename):
+    """Count the URLs in a file, without loading the file in memory."""
+    return sum(1 for _ in read_urls(filename))
+
+
+def spotify_client():
+    """Create a Spotify client, using the credentials from the environment."""
+    from spotipy.oauth2 import SpotifyClientCredentials
+    import spotipy
+
+    return spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials())
+
+
+@functools.lru_cache(maxsize=None)
+def youtube_api_client():
+    """
+    Return the YouTube Data API client shared by all searches. Creating a
+    client validates the API key with a request, so it is only done once.
+    Its searches go through the shared HTTP session instead of a session of its own.
+    """
+    from youtube_api import YouTubeDataAPI
+
+    client = YouTubeDataAPI(os.environ.get('YOUTUBE_API_KEY'))
+    client.session = session()
+    return client
+
+
+def stream_number(text):
+    """The number in a pytube quality label like '720p' or '160kbps', or 0."""
+    match = NUMBER_REGEX.match(text or '')
+    return int(match.group()) if match else 0
+
+
+class AdaptiveStreams:
+    """
+    A video-only and an audio-only stream of a video, downloaded in parallel
+    and muxed into an mp4 file. Has the attributes of a single stream that
+    the Downloader uses for progress and space checks.
+    """
+
+    def __init__(self, video, audio):
+        self.video = video
+        self.audio = audio
+        self.filesize = video.filesize + audio.filesize
+        self.default_filename = os.path.splitext(video.default_filename)[0] + '.mp4'
+
+
+class FormatPolicy:
+    """
+    Which streams of a video are downloaded. Picks the cheapest stream that
+    meets the policy, instead of whatever pytube lists first:
+
+    With video, the highest resolution up to max_resolution, and of the
+    streams with that resolution the smallest one. When adaptive is set
+    and the separate (DASH) video and audio streams have a higher
+    resolution than the progressive streams, those are downloaded and muxed.
+    Without video, the smallest audio-only stream with at least the bitrate
+    of the mp3 file, or the best one if none has.
+
+    Streams with the preferred codec (a prefix like 'avc1', 'vp9', 'mp4a' or
+    'opus') are picked over others, and streams larger than max_filesize
+    bytes are never picked.
+    """
+    MP3_BITRATE = 128  # kbps, the default of ffmpeg's mp3 encoder
+    MAX_RESOLUTION = 1080
+
+    def __init__(self, include_video=False, max_resolution=MAX_RESOLUTION, codec=None, max_filesize=None, adaptive=True):
+        self.format = 'mp4' if include_video else 'mp3'
+        self.needs_conversion = not include_video
+        self.max_resolution = max_resolution
+        self.codec = codec or ('avc1' if include_video else None)  # H.264 plays everywhere
+        self.max_filesize = max_filesize
+        self.adaptive = adaptive and include_video
+
+    def select(self, youtube):
+        """Return the stream to download from a pytube.YouTube object, an AdaptiveStreams or None."""
+        streams = list(youtube.streams)
+        audio_streams = [stream for stream in streams if stream.includes_audio_track and not stream.includes_video_track]
+        if self.needs_conversion:
+            candidates = audio_streams or [stream for stream in streams if stream.includes_audio_track]
+            return self.pick_audio(candidates, self.MP3_BITRATE, self.codec, self.max_filesize)
+
+        progressive = self.pick_video([stream for stream in streams if stream.is_progressive], self.max_filesize)
+        if self.adaptive:
+            video_streams = [stream for stream in streams if stream.is_adaptive and stream.includes_video_track]
+            audio = self.pick_audio(audio_streams, None, 'mp4a', self.max_filesize)  # AAC, like the progressive streams
+            if audio is not None:
+                budget = self.max_filesize - audio.filesize if self.max_filesize else None
+                video = self.pick_video(video_streams, budget)
+                if video is not None and (progressive is None or self.height(video) > self.height(progressive)):
+                    return AdaptiveStreams(video, audio)
+        return progressive
+
+    def height(self, stream):
+        return stream_number(stream.resolution)
+
+    def fits(self, stream, max_filesize):
+        return max_filesize is None or stream.filesize <= max_filesize
+
+    def pick_video(self, streams, max_filesize):
+        """The highest resolution up to max_resolution, preferred codec first, then the smallest one that fits."""
+        streams = [
+            stream for stream in streams
+            if self.height(stream) and (self.max_resolution is None or self.height(stream) <= self.max_resolution)
+        ]
+        streams.sort(key=lambda stream: (
+            -self.height(stream), not (stream.video_codec or '').startswith(self.codec or ''), stream.filesize
+        ))
+        return next((stream for stream in streams if self.fits(stream, max_filesize)), None)
+
+    def pick_audio(self, streams, min_bitrate, codec, max_filesize):
+        """
+        The smallest audio stream with at least min_bitrate kbps, or the one
+        with the highest bitrate if none has (or min_bitrate is None).
+        Streams with the preferred codec come first.
+        """
+        streams = [stream for stream in streams if self.fits(stream, max_filesize)]
+        preferred = [stream for stream in streams if (stream.audio_codec or '').startswith(codec or '')]
+        streams = preferred or streams
+        enough = [stream for stream in streams if min_bitrate and stream_number(stream.abr) >= min_bitrate]
+        if enough:
+            return min(enough, key=lambda stream: stream.filesize)
+        return max(streams, key=lambda stream: (stream_number(stream.abr), -stream.filesize), default=None)
+
+
+def run_pool(function, items, workers, stopped):
+    """
+    Call function on every item, using at most the given number of threads.
+
+    Items are submitted lazily, so only a few of them are waiting at any time.
+    When stopped() becomes true no new items are started, but the items that
+    are already running finish before this function returns.
+    """
+    slots = threading.BoundedSemaphore(2 * workers)
+    errors = []
+
+    def done(future):
+        if future.exception() is not None:
+            errors.append(future.exception())
+        slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Worker") as pool:
+        for item in items:
+            slots.acquire()
+            if stopped() or errors:
+                slots.release()
+                break
+            pool.submit(function, item).add_done_callback(done)
+
+    if errors:
+        raise errors[0]
+
+
+class DownloadCounter:
+    """Thread-safe tally of download results, shared by worker threads."""
+
+    def __init__(self, *keys):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(keys, 0)
+
+    def add(self, key):
+        """Increase a counter and return a snapshot of all counters."""
+        with self._lock:
+            self.counts[key] += 1
+            return dict(self.counts)
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self.counts[key]
+
+
+class Transcoder:
+    """
+    Second stage of the download pipeline: converts finished downloads to mp3
+    on a pool of processes, so conversions overlap with the next downloads
+    and use all CPU cores. Downloaders feed file paths in with submit.
+    Call wait when all downloads are done.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes
+        self._pool = None  # Started by the first submit, most downloads are never converted here
+        self._lock = threading.Lock()
+        self.errors = []
+
+    def pool(self):
+        """Return the process pool, starting it if needed."""
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context('spawn')  # Forking a process running Tk is unsafe
+                self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+            return self._pool
+
+    def submit(self, media_path, mp3_path=None, callback=None):
+        """
+        Queue a downloaded file for conversion to mp3, see convert_to_mp3. The optional
+        callback is called with the path of the mp3 file after a successful conversion.
+        """
+        future = self.pool().submit(measured, convert_to_mp3, media_path, mp3_path)
+        future.add_done_callback(functools.partial(self._done, callback))
+
+    def _done(self, callback, future):
+        if future.cancelled():
+            return
+        try:
+            if future.exception() is not None:
+                raise future.exception()
+            mp3_path, recorded = future.result()
+            metrics.merge(recorded)
+            if callback is not None and mp3_path is not None:
+                callback(mp3_path)
+        except Exception as error:
+            with self._lock:
+                self.errors.append(error)
+
+    def wait(self):
+        """Wait for all queued conversions and raise the first error, if any."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+
+class Downloader:
+    """
+    Downloads YouTube videos to a target directory as mp4 or mp3 files.
+    Videos that are already in the download index of the directory are skipped.
+    Files are placed in the directory by its OutputDirectory when they are complete.
+
+    Use as a context manager: leaving the block waits for the remaining
+    conversions and closes the index. The stopped callable is polled
+    to cancel a download. Progress events are published on the bus.
+
+    The backend is the way streams are converted to mp3. With 'ffmpeg' the
+    stream is piped into ffmpeg while it downloads, with 'moviepy' it is
+    downloaded first and converted by the Transcoder. When ffmpeg is not
+    found the moviepy backend is used.
+
+    The streams to download are chosen by a FormatPolicy, by default one
+    for include_video. Adaptive streams are only used when ffmpeg is found.
+
+    Downloaders that run at the same time can share a semaphore as slots,
+    which limits the number of streams they download together.
+    """
+
+    def __init__(self, target, include_video=False, workers=1, stopped=None, bus=None, backend='ffmpeg', slots=None,
+                 policy=None):
+        self.target = target
+        self.muxer = ffmpeg_executable()
+        self.policy = policy or FormatPolicy(include_video)
+        self.policy.adaptive = self.policy.adaptive and self.muxer is not None
+        self.ffmpeg = self.muxer if backend == 'ffmpeg' else None
+        self.workers = max(1, workers)
+        self.slots = slots or threading.BoundedSemaphore(self.workers)
+        self.stopped = stopped or (lambda: False)
+        self.bus = bus or SilentBus()
+        self.scheduler = Scheduler(stopped=self.stopped)
+        self.output = OutputDirectory(target)  # Creates the target directory, so it comes before the index
+        self.index = DownloadIndex(target)
+        self.transcoder = Transcoder()
+        self._lock = threading.Lock()
+        self._video_locks = {}
+        self._results = collections.OrderedDict()  # Recent results, for videos that are listed more than once
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """Wait for the remaining conversions and close the index."""
+        try:
+            self.transcoder.wait()
+        finally:
+            self.output.close()
+            self.index.close()
+
+    def download_url(self, url):
+        """
+        Download the video at a YouTube URL.
+        Returns 'downloaded', 'invalid', 'not_available' or 'cancelled'.
+        """
+        with metrics.span('validate'):
+            video_id = youtube_video_id(url)
+        if video_id is None:
+            return 'invalid'
+        try:
+            return self.download_video(video_id)
+        except DownloadCancelled:
+            return 'cancelled'
+
+    def download_urls(self, urls):
+        """
+        Download an iterable of YouTube URLs on a pool of worker threads.
+        The streams are resolved ahead of the downloads, see prefetch.
+
+        Videos that still fail with a transient error after the retries of the
+        scheduler are queued again behind the other URLs, at most REQUEUES
+        times. After that they are counted as failed, like videos that fail
+        with other errors, see failed. Only fatal errors, like a full disk,
+        stop the download and are raised. Returns the DownloadCounter.
+        """
+        counter = DownloadCounter('downloaded', 'invalid', 'not_available', 'failed', 'cancelled')
+        requeued = []
+        requeues = collections.Counter()
+        lock = threading.Lock()
+
+        def count(result, times=1):
+            for _ in range(times):
+                self.bus.publish('counts', counter.add(result))
+
+        def retry_later(video_id, times, error):
+            if is_fatal(error):
+                raise error
+            if is_transient(error):
+                with lock:
+                    requeues[video_id] += 1
+                    if requeues[video_id] <= REQUEUES:
+                        requeued.extend([f'https://www.youtube.com/watch?v={video_id}'] * times)
+                        return
+            self.failed(video_id, error)
+            count('failed', times)
+
+        def download(item):
+            video_id, times, stream = item
+            try:
+                result = self.download_video(video_id, stream)
+            except DownloadCancelled:
+                result = 'cancelled'
+            except Exception as error:
+                retry_later(video_id, times, error)
+                return
+            count(result, times)
+
+        while not self.stopped():
+            streams = self.prefetch(urls, count, retry_later)
+            try:
+                run_pool(download, streams, self.workers, self.stopped)
+            finally:
+                streams.close()
+            if not requeued:
+                break
+            urls, requeued = requeued, []
+        return counter
+
+    def prefetch(self, urls, count, retry_later):
+        """
+        Resolve the streams of URLs on a pool of threads, at most PREFETCH_SIZE
+        videos ahead of the downloads, and yield them as soon as they are
+        resolved, so downloads start right away and never wait for the rate
+        limited metadata requests of a whole batch. Of the streams that are
+        resolved when a download slot frees up, the smallest is yielded first.
+        Repeated videos are resolved once, their ids are taken from the URLs
+        without network calls. Invalid, unavailable and already downloaded
+        videos are passed to count right away, and the size of every stream is
+        published when it is resolved so the ETA is known early. Videos that
+        fail to resolve are passed to retry_later.
+
+        When stopped, the videos that are not resolved yet are dropped.
+
+        Yields (video_id, times listed, stream) tuples.
+        """
+        urls = iter(urls)
+        times = {}  # Videos that are resolved or being resolved, to the number of times they are listed
+        resolved = queue.Queue()
+        ready = []  # Heap of the resolved streams that are not yielded yet, by size
+
+        def resolve(video_id):
+            try:
+                if self.stopped():
+                    resolved.put((video_id, 'cancelled'))
+                elif self.index.contains(video_id, self.policy.format):
+                    metrics.count('index_hits')
+                    resolved.put((video_id, 'downloaded'))
+                else:
+                    resolved.put((video_id, self.resolve_stream(video_id)))
+            except Exception as error:
+                resolved.put((video_id, error))
+
+        def collect(video_id, outcome):
+            if outcome in ('downloaded', 'cancelled', None) or isinstance(outcome, Exception):
+                listed = times.pop(video_id)
+                if outcome == 'downloaded':
+                    count('downloaded', listed)
+                elif outcome is None:
+                    count('not_available', listed)
+                elif isinstance(outcome, Exception):
+                    retry_later(video_id, listed, outcome)
+            else:
+                self.bus.publish('expected', outcome.filesize)
+                heapq.heappush(ready, (outcome.filesize, video_id, outcome))
+
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Prefetch")
+        try:
+            while not self.stopped():
+                while len(times) < PREFETCH_SIZE and not self.stopped():
+                    url = next(urls, None)
+                    if url is None:
+                        break
+                    with metrics.span('validate'):
+                        video_id = youtube_video_id(url)
+                    if video_id is None:
+                        count('invalid')
+                    elif video_id in times:
+                        times[video_id] += 1
+                    else:
+                        times[video_id] = 1
+                        pool.submit(resolve, video_id)
+
+                if not ready:
+                    if not times:
+                        return
+                    collect(*resolved.get())
+                while not resolved.empty():
+                    collect(*resolved.get())
+                if ready and not self.stopped():
+                    _, video_id, stream = heapq.heappop(ready)
+                    yield video_id, times.pop(video_id), stream
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def download_playlist(self, spotify, playlist):
+        """
+        Find the tracks of a Spotify playlist on YouTube and download them.
+        Returns the DownloadCounter.
+        """
+        from pipeline import SpotifyPipeline
+
+        resolutions = ResolutionCache()
+        try:
+            pipeline = SpotifyPipeline(self, spotify, playlist, resolutions)
+            pipeline.run()
+        finally:
+            resolutions.close()
+        return pipeline.counter
+
+    def download_video(self, video_id, stream=None):
+        """
+        Download a video by id, unless it is in the index already. The stream
+        to download is resolved here, unless it was prefetched already.
+        Returns 'downloaded' or 'not_available', raises DownloadCancelled when stopped.
+        A video is only downloaded by one thread at a time.
+        """
+        with self._lock:
+            video_lock, users = self._video_locks.get(video_id, (threading.Lock(), 0))
+            self._video_locks[video_id] = (video_lock, users + 1)
+        try:
+            with video_lock:
+                if video_id not in self._results:
+                    self._results[video_id] = self._download_video(video_id, stream)
+                    if len(self._results) > RESULTS_SIZE:
+                        self._results.popitem(last=False)
+                return self._results[video_id]
+        finally:
+            with self._lock:
+                video_lock, users = self._video_locks.pop(video_id)
+                if users > 1:
+                    self._video_locks[video_id] = (video_lock, users - 1)
+
+    def _download_video(self, video_id, stream):
+        if self.index.contains(video_id, self.policy.format):
+            metrics.count('index_hits')
+            return 'downloaded'
+
+        if stream is None:
+            stream = self.resolve_stream(video_id)
+            if stream is None:
+                return 'not_available'
+            self.bus.publish('expected', stream.filesize)
+
+        filename = stream.default_filename
+        if self.policy.needs_conversion:
+            filename = os.path.splitext(filename)[0] + '.mp3'
+        path = self.output.claim(video_id, filename, stream.filesize)
+        try:
+            with self.slots:
+                self.bus.publish('item', (video_id, os.path.splitext(filename)[0], stream.filesize))
+                if self.policy.needs_conversion and self.ffmpeg:
+                    self.transcode_stream(video_id, stream, path)
+                elif self.policy.needs_conversion:
+                    media_path = self.output.temp_path(video_id, os.path.splitext(stream.default_filename)[1])
+                    self.download_stream(video_id, stream, media_path, media_path + '.part')
+                elif isinstance(stream, AdaptiveStreams):
+                    self.download_adaptive(video_id, stream, path)
+                else:
+                    extension = os.path.splitext(stream.default_filename)[1]
+                    self.download_stream(video_id, stream, path, self.output.temp_path(video_id, extension + '.part'))
+        except BaseException:
+            self.output.release(path)
+            raise
+        finally:
+            self.bus.publish('item_done', video_id)
+
+        if self.policy.needs_conversion and not self.ffmpeg:
+            self.transcoder.submit(media_path, path, functools.partial(self.converted, video_id))
+        else:
+            self.converted(video_id, path)
+        return 'downloaded'
+
+    def converted(self, video_id, path):
+        """Record a file that is in place in the index."""
+        self.index.add(video_id, self.policy.format, path)
+        self.output.release(path)
+
+    def resolve_stream(self, video_id):
+        """Return the stream to download for a video, or None. Rate limited and retried by the scheduler."""
+        return self.scheduler.call('youtube', self.select_stream, video_id)
+
+    def select_stream(self, video_id):
+        """Fetch the metadata of a video and return the stream to download, or None if it is unavailable."""
+        import pytube
+        import pytube.exceptions
+
+        install_pytube_transport()
+        youtube = pytube.YouTube(f'https://www.youtube.com/watch?v={video_id}')
+        try:
+            with metrics.span('metadata'):
+                youtube.streams  # Fetches the player response, the streams are cached on the object
+        except pytube.exceptions.VideoUnavailable:
+            return None
+        with metrics.span('select'):
+            return self.policy.select(youtube)
+
+    def download_stream(self, video_id, video, path, part):
+        """
+        Download a pytube stream to path, through a part file in the temporary
+        directory of the output. The download can be resumed after it is
+        stopped, and large streams are downloaded in parallel segments.
+        """
+        segments = SEGMENTS if video.filesize > SEGMENT_THRESHOLD else 1
+        with metrics.span('download'):
+            return self.scheduler.call('stream', download_file, video.url, path, video.filesize, segments,
+                                       self.stopped, functools.partial(self.received, video_id), part)
+
+    def download_adaptive(self, video_id, streams, path):
+        """Download the video and audio stream of AdaptiveStreams in parallel and mux them to path."""
+        video_path = self.output.temp_path(video_id, '.video')
+        audio_path = self.output.temp_path(video_id, '.audio')
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="Adaptive") as pool:
+            downloads = [
+                pool.submit(self.download_stream, video_id, streams.video, video_path, video_path + '.part'),
+                pool.submit(self.download_stream, video_id, streams.audio, audio_path, audio_path + '.part'),
+            ]
+            for download in downloads:
+                download.result()
+        with metrics.span('mux'):
+            return mux_streams(self.muxer, video_path, audio_path, path, self.output.temp_path(video_id, '.mp4.part'))
+
+    def transcode_stream(self, video_id, video, mp3_path):
+        """Download a pytube stream of a video through ffmpeg to mp3_path, encoding it in the temporary directory."""
+        part = self.output.temp_path(video_id, '.mp3.part')
+        with metrics.span('download_transcode'):
+            return self.scheduler.call('stream', transcode_stream, self.ffmpeg, video.url, mp3_path, video.filesize,
+                                       self.stopped, functools.partial(self.received, video_id), part)
+
+    def failed(self, item, error):
+        """Report the error of an item that failed, like a video or a track. The other items go on."""
+        metrics.count('failed_items')
+        self.bus.publish('error', f"{item}: {type(error).__name__}: {error}")
+
+    def received(self, video_id, size):
+        """Count bytes of a stream of a video as received."""
+        metrics.count('bytes_received', size)
+        self.bus.publish('bytes', size)
+        self.bus.publish('item_bytes', (video_id, size))
+
+    def search_youtube(self, query):
+        """Return the top 5 YouTube search results for a query."""
+        with metrics.span('search'):
+            return youtube_api_client().search(q=query, max_results=5)
+
+    def search_track(self, track):
+        """
+        Search YouTube for a Spotify track and return the top 5 results.
+        Pick the best match with matching.best_match, after looking up the
+        durations of the results, batched over tracks, with video_durations.
+        """
+        artist = track['artists'][0]['name']
+        return self.scheduler.call('search', self.search_youtube, f"{artist} {track['name']}")
+
+    def video_durations(self, video_ids):
+        """Return the durations in seconds of at most DURATIONS_BATCH videos by id, fetched in a single call."""
+        with metrics.span('durations'):
+            items = youtube_api_client().get_video_metadata(video_ids, parser=None, part=['contentDetails'])
+        return {item['id']: parse_duration(item['contentDetails']['duration']) for item in items if item}
@@ -0,0 +1,448 @@
+# Youtube-downloader
+#
+# Tk GUI of the downloader. The pages only collect input and show progress,
+# the downloading itself is done by the engine.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from engine import YOUTUBE_REGEX, spotify_client
+from jobs import JobQueue
+from progress import ProgressState
+from tkinter import filedialog
+import os
+import re
+import tkinter as tk
+
+
+FRAME_RATE = 10  # Progress updates per second
+EMOJI_REGEX = re.compile("["
+    u"\U0001F600-\U0001F64F"  # emoticons
+    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+    u"\U0001F680-\U0001F6FF"  # transport & map symbols
+    u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "]+", flags=re.UNICODE)
+
+
+class Page(tk.Frame):
+    """Base class for a GUI page. Contains methods that all pages need."""
+
+    def __init__(self, *args, queue=None, **kwargs):
+        tk.Frame.__init__(self, *args, **kwargs)
+        self.youtube_regex = YOUTUBE_REGEX
+        self.queue = queue
+
+    def clip_string(self, string):
+        """Clip long strings (file paths for example) so they don't mess up the GUI."""
+        return (string[:35] + '...') if len(string) > 35 else string
+
+
+class SingleUrlPage(Page):
+    """Page in the GUI for downloading from a single URL."""
+
+    def __init__(self, *args, **kwargs):
+        Page.__init__(self, *args, **kwargs)
+        self.target = os.path.expanduser("~/Downloads")
+        self.include_video = tk.IntVar()
+        self.include_video.set(0)
+        self.make_widgets()
+
+    def make_widgets(self):
+        """Create the widgets that make up the page and position them."""
+        self.dir_label = tk.Label(self, text=self.clip_string("Target: " + self.target))
+        self.dir_label.grid(row=0, column=0, pady=20, padx=10)
+
+        self.dir_button = tk.Button(self, command=self.change_target, text="Choose directory")
+        self.dir_button.grid(row=0, column=1)
+
+        self.url_label = tk.Label(self, text="YouTube URL:")
+        self.url_label.grid(row=1, column=0, pady=20, padx=10)
+
+        self.url_entry = tk.Entry(self, width=40)
+        self.url_entry.grid(row=1, column=1)
+
+        self.video_checkbox = tk.Checkbutton(self, variable=self.include_video, onvalue=1, offvalue=0, text="Include video")
+        self.video_checkbox.grid(row=2, column=0, pady=20, padx=10)
+
+        self.submit_button = tk.Button(self, command=self.download, text="Download")
+        self.submit_button.grid(row=2, column=1)
+
+        self.status_label = tk.Label(self, text="")
+        self.status_label.grid(row=3, columnspan=2, pady=20, padx=10)
+
+    def download(self):
+        """
+        Adds the youtube video from the url stored in url_entry to the queue.
+
+        Stores video in target location as mp4 or converts to mp3.
+        """
+        url = self.url_entry.get()
+
+        if not self.youtube_regex.match(url):
+            self.status_label.configure(text="URL is not a YouTube URL!", fg="red")
+            return
+
+        self.queue.add('url', url, url, self.target, self.include_video.get())
+        self.url_entry.delete(0, tk.END)
+        self.status_label.configure(text="Added to the queue.", fg="green")
+
+    def change_target(self):
+        """Changes the target directory (storage location)."""
+        directory = tk.filedialog.askdirectory()
+        if directory in [(), '']:
+            return  # User pressed cancel
+        self.target = directory
+        self.dir_label.configure(text=self.clip_string("Target: " + self.target))
+
+
+class FilePage(Page):
+    """Page in the GUI for downloading from a file containing Youtube URLs."""
+
+    def __init__(self, *args, **kwargs):
+        Page.__init__(self, *args, **kwargs)
+        self.target = os.path.expanduser("~/Downloads")
+        self.filename = "No file chosen"
+        self.include_video = tk.IntVar()
+        self.include_video.set(0)
+        self.make_widgets()
+
+    def make_widgets(self):
+        """Create the widgets that make up the page and position them."""
+        self.file_button = tk.Button(self, command=self.choose_file, text="Choose file")
+        self.file_button.grid(row=0, column=0, pady=20, padx=20)
+
+        self.file_label = tk.Label(self, text=self.clip_string(self.filename))
+        self.file_label.grid(row=0, column=1)
+
+        self.dir_button = tk.Button(self, command=self.change_target, text="Choose target directory")
+        self.dir_button.grid(row=1, column=0, pady=20, padx=20)
+
+        self.dir_label = tk.Label(self, text=self.clip_string(self.target))
+        self.dir_label.grid(row=1, column=1, pady=20, padx=20)
+
+        self.video_checkbox = tk.Checkbutton(self, variable=self.include_video, onvalue=1, offvalue=0, text="Include video")
+        self.video_checkbox.grid(row=2, column=0, pady=20, padx=20)
+
+        self.submit_button = tk.Button(self, command=self.download, text="Download")
+        self.submit_button.grid(row=2, column=1)
+
+        self.error_label = tk.Label(self, text="", fg="red")
+        self.error_label.grid(row=3, column=0, pady=20, padx=10)
+
+        self.status_label = tk.Label(self, text="", fg="green")
+        self.status_label.grid(row=3, column=1, pady=20, padx=10)
+
+    def choose_file(self):
+        """Choose a file to use as input."""
+        filename = filedialog.askopenfilename()
+        if filename in [(), '']:
+            return  # User pressed cancel
+        self.filename = filename
+        self.file_label.configure(text=self.clip_string(self.filename))
+
+    def download(self):
+        """
+        Adds all youtube videos from the urls listed in the given file to the queue.
+        Stores videos in target location as mp4 or converts to mp3.
+        """
+        self.error_label.configure(text="")
+        self.status_label.configure(text="")
+        if not os.path.isfile(self.filename):
+            self.error_label.configure(text="File not found.")
+            return
+
+        self.queue.add('file', self.filename, os.path.basename(self.filename), self.target, self.include_video.get())
+        self.status_label.configure(text="Added to the queue.")
+
+    def change_target(self):
+        """Changes the target directory (storage location)."""
+        directory = tk.filedialog.askdirectory()
+        if directory in [(), '']:
+            return  # User pressed cancel
+        self.target = directory
+        self.dir_label.configure(text=self.clip_string(self.target))
+
+
+class SpotifyPage(Page):
+    """Page in the GUI for downloading from a Spotify playlist."""
+
+    def __init__(self, *args, **kwargs):
+        Page.__init__(self, *args, **kwargs)
+        self.spotify = None  # Created by the first search, so the GUI starts without loading spotipy
+        self.target = os.path.expanduser("~/Downloads")
+        self.include_video = tk.IntVar()
+        self.include_video.set(0)
+        self.playlist = {}
+        self.make_widgets()
+
+    def make_widgets(self):
+        """Create the widgets that make up the page and position them."""
+        self.disclaimer = tk.Label(
+            self,
+            text="Note: this tool downloads the songs from Youtube.\n" +
+                 "This will not work for every song and downloads can\n" +
+                 "be different from the Spotify songs."
+        )
+        self.disclaimer.grid(row=0, columnspan=2)
+
+        self.search_label = tk.Label(self, text="Search Spotify playlist:")
+        self.search_label.grid(row=1, column=0, pady=20, padx=10)
+
+        self.search_entry = tk.Entry(self, width=40)
+        self.search_entry.grid(row=1, column=1)
+
+        self.search_button = tk.Button(self, command=self.search_playlist, text="Search")
+        self.search_button.grid(row=2, column=0, pady=20, padx=20)
+
+        self.current_playlist = tk.Label(self, text="No playlist found")
+        self.current_playlist.grid(row=2, column=1)
+
+        self.dir_button = tk.Button(self, command=self.change_target, text="Choose target directory")
+        self.dir_button.grid(row=3, column=0, pady=20, padx=20)
+
+        self.dir_label = tk.Label(self, text=self.clip_string(self.target))
+        self.dir_label.grid(row=3, column=1, pady=20, padx=20)
+
+        self.video_checkbox = tk.Checkbutton(self, variable=self.include_video, onvalue=1, offvalue=0, text="Include video")
+        self.video_checkbox.grid(row=4, column=0, pady=20, padx=20)
+
+        self.submit_button = tk.Button(self, command=self.download, text="Download")
+        self.submit_button.grid(row=4, column=1)
+
+        self.error_label = tk.Label(self, text="", fg="red")
+        self.error_label.grid(row=5, column=0, pady=20, padx=10)
+
+        self.status_label = tk.Label(self, text="", fg="green")
+        self.status_label.grid(row=5, column=1, pady=20, padx=10)
+
+    def search_playlist(self):
+        """Search for a Spotify playlist and display the name of the first match."""
+        term = self.search_entry.get()
+        if (term == ''):
+            self.current_playlist.configure(text='No playlist found')
+            self.playlist = {}
+            return
+
+        if self.spotify is None:
+            self.spotify = spotify_client()
+        result = self.spotify.search(q=term, type='playlist', limit=1)
+
+        if len(result['playlists']['items']) == 0:
+            self.current_playlist.configure(text='No playlist found')
+            self.playlist = {}
+            return
+
+        self.playlist = result['playlists']['items'][0]
+        self.current_playlist.configure(text=self.clip_string(self.playlist_name()))
+
+    def playlist_name(self):
+        """Name of the selected playlist, with its owner and without emojis."""
+        return self.de_emojify(self.playlist['owner']['display_name'] + ' - ' + self.playlist['name'])
+
+    def is_valid(self):
+        """Check for possible errors before starting the download."""
+        if self.playlist == {}:
+            self.error_label.configure(text="Please search a playlist first.")
+            return False
+
+        return True
+
+    def download(self):
+        """
+        Adds the selected Spotify playlist to the queue. Its songs
+        are searched on Youtube and downloaded from there.
+        Stores videos in target location as mp4 or converts to mp3.
+        """
+        self.error_label.configure(text="")
+        self.status_label.configure(text="")
+        if not self.is_valid():
+            return
+
+        self.queue.add(
+            'spotify', self.playlist['id'], self.playlist_name(), self.target,
+            self.include_video.get(), total=self.playlist['tracks']['total']
+        )
+        self.status_label.configure(text="Added to the queue.")
+
+    def change_target(self):
+        """Changes the target directory (storage location)."""
+        directory = tk.filedialog.askdirectory()
+        if directory in [(), '']:
+            return  # User pressed cancel
+        self.target = directory
+        self.dir_label.configure(text=self.clip_string(self.target))
+
+    def de_emojify(self, string):
+        """Remove emojis from a string."""
+        return EMOJI_REGEX.sub(r'', string)
+
+
+class QueuePage(Page):
+    """
+    Page in the GUI showing the download queue. Jobs can be cancelled,
+    retried and removed, and the number of parallel downloads changed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        Page.__init__(self, *args, **kwargs)
+        self.jobs = []
+        self.progress_state = ProgressState()
+        self.workers = tk.IntVar()
+        self.workers.set(self.queue.slots.size)
+        self.make_widgets()
+        self.refresh()
+        self.after(1000 // FRAME_RATE, self.poll)
+
+    def make_widgets(self):
+        """Create the widgets that make up the page and position them."""
+        self.list_frame = tk.Frame(self)
+        self.list_frame.grid(row=0, columnspan=4, pady=10, padx=10)
+
+        self.scrollbar = tk.Scrollbar(self.list_frame)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.job_list = tk.Listbox(self.list_frame, width=75, height=12, yscrollcommand=self.scrollbar.set)
+        self.job_list.pack(side="left", fill="both")
+        self.scrollbar.configure(command=self.job_list.yview)
+
+        self.cancel_button = tk.Button(self, command=lambda: self.on_selected(self.queue.cancel), text="Cancel")
+        self.cancel_button.grid(row=1, column=0, pady=10)
+
+        self.retry_button = tk.Button(self, command=lambda: self.on_selected(self.queue.retry), text="Retry")
+        self.retry_button.grid(row=1, column=1)
+
+        self.remove_button = tk.Button(self, command=lambda: self.on_selected(self.queue.remove), text="Remove")
+        self.remove_button.grid(row=1, column=2)
+
+        self.workers_label = tk.Label(self, text="Parallel downloads:")
+        self.workers_label.grid(row=2, column=0, columnspan=2, pady=10)
+
+        self.workers_spinbox = tk.Spinbox(
+            self, from_=1, to=16, width=5, textvariable=self.workers, command=self.change_workers
+        )
+        self.workers_spinbox.grid(row=2, column=2)
+
+        self.speed_label = tk.Label(self, text="")
+        self.speed_label.grid(row=3, columnspan=4)
+
+        self.item_list = tk.Listbox(self, width=75, height=4)
+        self.item_list.grid(row=4, columnspan=4, pady=10, padx=10)
+
+    def on_selected(self, command):
+        """Call command with the id of every selected job."""
+        for index in self.job_list.curselection():
+            command(self.jobs[index]['id'])
+
+    def change_workers(self):
+        """Change the number of downloads the jobs share."""
+        try:
+            self.queue.slots.resize(self.workers.get())
+        except tk.TclError:
+            pass  # Spinbox contains something that is not a number
+
+    def describe(self, job):
+        """Line of the job list for a job, like 'running  My playlist  12/40 downloaded, 1 failed'."""
+        counts = job['counts']
+        done = counts.get('downloaded', 0)
+        failed = sum(value for key, value in counts.items() if key not in ('downloaded', 'cancelled'))
+        text = f"{job['state']:<10} {self.clip_string(job['name'])}  {done}/{job['total'] or '?'} downloaded"
+        if failed:
+            text += f", {failed} failed"
+        if job['error']:
+            text += f" ({job['error']})"
+        return text
+
+    def refresh(self):
+        """Show the current state of the jobs, keeping the selection."""
+        selected = {self.jobs[index]['id'] for index in self.job_list.curselection()}
+        self.jobs = self.queue.jobs()
+        self.job_list.delete(0, tk.END)
+        for index, job in enumerate(self.jobs):
+            self.job_list.insert(tk.END, self.describe(job))
+            if job['id'] in selected:
+                self.job_list.selection_set(index)
+
+        running = [job for job in self.jobs if job['state'] == 'running']
+        if not running:
+            self.progress_state = ProgressState()  # Speed and ETA restart with the next job
+        self.progress_state.total = sum(job['total'] or 0 for job in running)
+        self.progress_state.counts = {
+            'done': sum(sum(job['counts'].values()) for job in running)
+        }
+
+    def poll(self):
+        """
+        Apply the events published by the queue to the widgets.
+        Runs in the Tk main loop at a fixed frame rate, so a burst of
+        events results in a single update of the widgets.
+        """
+        changed = False
+        for kind, value in self.queue.bus.drain():
+            if kind == 'job':
+                changed = True
+            else:
+                self.progress_state.apply(kind, value)
+
+        if changed:
+            self.refresh()
+        running = any(job['state'] == 'running' for job in self.jobs)
+        self.speed_label.configure(text=self.progress_state.describe() if running else "")
+        items = self.progress_state.describe_items()
+        if list(self.item_list.get(0, tk.END)) != items:
+            self.item_list.delete(0, tk.END)
+            self.item_list.insert(tk.END, *items)
+        self.after(1000 // FRAME_RATE, self.poll)
+
+
+class YoutubeDownloader(tk.Frame):
+    """
+    Main frame for the GUI, contains the pages and navigation buttons.
+    The download pages add jobs to a queue, shown on the queue page.
+    """
+
+    def __init__(self, *args, **kwargs):
+        tk.Frame.__init__(self, *args, **kwargs)
+
+        self.winfo_toplevel().title("Youtube Downloader")
+
+        self.queue = JobQueue()
+        self.p1 = SingleUrlPage(self, queue=self.queue)
+        self.p2 = FilePage(self, queue=self.queue)
+        self.p3 = SpotifyPage(self, queue=self.queue)
+        self.p4 = QueuePage(self, queue=self.queue)
+
+        self.buttonframe = tk.Frame(self)
+        self.container = tk.Frame(self)
+        self.buttonframe.pack(side="top", fill="x", expand=False)
+        self.container.pack(side="top", fill="both", expand=True)
+
+        self.p1.place(in_=self.container, x=0, y=0, relwidth=1, relheight=1)
+        self.p2.place(in_=self.container, x=0, y=0, relwidth=1, relheight=1)
+        self.p3.place(in_=self.container, x=0, y=0, relwidth=1, relheight=1)
+        self.p4.place(in_=self.container, x=0, y=0, relwidth=1, relheight=1)
+
+        self.b1 = tk.Button(self.buttonframe, text="Single url", command=self.p1.lift)
+        self.b2 = tk.Button(self.buttonframe, text="From file", command=self.p2.lift)
+        self.b3 = tk.Button(self.buttonframe, text="From Spotify", command=self.p3.lift)
+        self.b4 = tk.Button(self.buttonframe, text="Queue", command=self.p4.lift)
+
+        self.b1.pack(side="left")
+        self.b2.pack(side="left")
+        self.b3.pack(side="left")
+        self.b4.pack(side="left")
+        self.p1.lift()
+
+
+def main():
+    """Start the GUI. Jobs that are running when the window is closed continue at the next start."""
+    root = tk.Tk()
+    downloader = YoutubeDownloader(root)
+    downloader.pack(side="top", fill="both", expand=True)
+    root.wm_geometry("650x450")
+
+    def close():
+        downloader.queue.close()
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", close)
+    root.mainloop()
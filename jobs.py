@@ -0,0 +1,195 @@
+# Youtube-downloader
+#
+# Global queue of download jobs: single URLs, files with URLs and Spotify
+# playlists, downloaded together over a shared number of workers. The queue
+# is kept on disk, so it continues where it left off after a restart.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from engine import Downloader, count_urls, read_urls, spotify_client
+from progress import ProgressBus
+from storage import JobStore
+import threading
+
+ACTIVE_JOBS = 3  # Jobs that run at the same time, their downloads share the workers
+
+
+class Slots:
+    """Semaphore for the downloads of all jobs, its size can be changed while it is in use."""
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def resize(self, size):
+        """Change the number of downloads that can run at the same time."""
+        with self._condition:
+            self.size = max(1, size)
+            self._condition.notify_all()
+
+    def __enter__(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.used < self.size)
+            self.used += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._condition:
+            self.used -= 1
+            self._condition.notify()
+        return False
+
+
+class JobProgress(ProgressBus):
+    """
+    Bus given to the Downloader of a job. Counts are recorded in the job
+    store, byte events are passed on to the bus of the queue.
+    """
+
+    def __init__(self, queue, job_id):
+        super(JobProgress, self).__init__()
+        self.queue = queue
+        self.job_id = job_id
+
+    def publish(self, kind, value=None):
+        if kind == 'counts':
+            self.queue.store.update(self.job_id, counts=value)
+            self.queue.bus.publish('job', self.job_id)
+        elif kind in ('expected', 'bytes', 'item', 'item_bytes', 'item_done'):
+            self.queue.bus.publish(kind, value)
+
+
+class JobQueue:
+    """
+    Runs the jobs of a JobStore in a background thread, oldest first and at
+    most ACTIVE_JOBS at the same time. All jobs download over the same slots,
+    so a single URL added during a large download starts right away without
+    raising the total number of downloads.
+
+    Every change of a job is published on the bus as a ('job', job id)
+    event, next to the 'expected', 'bytes' and item events of the downloads.
+    """
+
+    def __init__(self, workers=4, store=None, bus=None):
+        self.store = store or JobStore()
+        self.bus = bus or ProgressBus()
+        self.slots = Slots(workers)
+        self._lock = threading.Lock()
+        self._running = {}  # Stop events of the running jobs, by job id
+        self._threads = []
+        self._closed = threading.Event()
+        self._wakeup = threading.Event()
+        self._spotify = None
+        self._thread = threading.Thread(target=self.run, name="JobQueue", daemon=True)
+        self._thread.start()
+
+    def add(self, kind, source, name, target, include_video, total=None):
+        """
+        Queue a job. The kind is 'url', 'file' or 'spotify', the source is a
+        YouTube URL, a filename or a Spotify playlist id. Returns the job id.
+        """
+        job_id = self.store.add(kind, source, name, target, 'mp4' if include_video else 'mp3', total)
+        self.changed(job_id)
+        return job_id
+
+    def jobs(self):
+        """Return all jobs, oldest first."""
+        return self.store.jobs()
+
+    def cancel(self, job_id):
+        """Cancel a job. A running job stops after its current downloads."""
+        with self._lock:
+            if job_id in self._running:
+                self._running[job_id].set()
+            else:
+                self.store.update(job_id, state='cancelled')
+        self.changed(job_id)
+
+    def retry(self, job_id):
+        """Queue a job that is finished, failed or cancelled again."""
+        with self._lock:
+            if job_id not in self._running:
+                self.store.update(job_id, state='queued', counts={}, error=None)
+        self.changed(job_id)
+
+    def remove(self, job_id):
+        """Remove a job that is not running from the queue."""
+        with self._lock:
+            if job_id not in self._running:
+                self.store.remove(job_id)
+        self.changed(job_id)
+
+    def changed(self, job_id):
+        self.bus.publish('job', job_id)
+        self._wakeup.set()
+
+    def run(self):
+        """Start queued jobs whenever there is room, runs in the queue thread."""
+        while not self._closed.is_set():
+            self._wakeup.clear()
+            with self._lock:
+                job = self.store.claim() if len(self._running) < ACTIVE_JOBS else None
+                if job is not None:
+                    self._running[job['id']] = threading.Event()
+            if job is None:
+                self._wakeup.wait()
+                continue
+            self.bus.publish('job', job['id'])
+            thread = threading.Thread(target=self.run_job, args=(job,), name=f"Job-{job['id']}", daemon=True)
+            thread.start()
+            self._threads = [thread for thread in self._threads if thread.is_alive()] + [thread]
+
+    def run_job(self, job):
+        """Download a job and record how it ended, runs in a thread of its own."""
+        stop = self._running[job['id']]
+        error = None
+        try:
+            self.download(job, lambda: stop.is_set() or self._closed.is_set())
+        except Exception as exception:
+            state, error = 'failed', str(exception)
+        else:
+            if stop.is_set():
+                state = 'cancelled'
+            elif self._closed.is_set():
+                state = 'queued'  # Continued at the next start
+            else:
+                state = 'done'
+
+        with self._lock:
+            self.store.update(job['id'], state=state, error=error)
+            del self._running[job['id']]
+        self.changed(job['id'])
+
+    def download(self, job, stopped):
+        """Download the URL, file or playlist of a job."""
+        progress = JobProgress(self, job['id'])
+        downloader = Downloader(job['target'], job['format'] == 'mp4', self.slots.size, stopped, progress, slots=self.slots)
+        try:
+            if job['kind'] == 'url':
+                self.store.update(job['id'], total=1)
+                progress.publish('counts', {downloader.download_url(job['source']): 1})
+            elif job['kind'] == 'file':
+                self.store.update(job['id'], total=count_urls(job['source']))
+                downloader.download_urls(read_urls(job['source']))
+            else:
+                playlist = {'id': job['source'], 'tracks': {'total': job['total']}}
+                downloader.download_playlist(self.spotify(), playlist)
+        finally:
+            downloader.close()
+
+    def spotify(self):
+        """The Spotify client of the queue, created when the first playlist is downloaded."""
+        with self._lock:
+            if self._spotify is None:
+                self._spotify = spotify_client()
+            return self._spotify
+
+    def close(self):
+        """Stop the queue. Running jobs stop after their current downloads and are queued for the next start."""
+        self._closed.set()
+        self._wakeup.set()
+        self._thread.join()
+        for thread in self._threads:
+            thread.join()
+        self.store.close()
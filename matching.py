@@ -0,0 +1,144 @@
+# Youtube-downloader
+#
+# Ranks YouTube search results as matches for a Spotify track, using only
+# the metadata of the search results, so no streams are looked up for
+# videos that are not downloaded.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from difflib import SequenceMatcher
+from urllib.parse import unquote
+import functools
+import html
+import re
+
+MIN_SCORE = 0.5  # Results scoring lower are not downloaded
+
+# Weights of the parts of a score, they add up to 1
+TITLE_WEIGHT = 0.4
+ARTIST_WEIGHT = 0.25
+DURATION_WEIGHT = 0.2
+CHANNEL_WEIGHT = 0.15
+
+DURATION_TOLERANCE = 30  # Seconds of difference at which the duration score drops to 0
+VERSION_PENALTY = 0.3  # For each version word in a title, like 'live', that the track name lacks
+WRONG_ARTIST_PENALTY = 0.5  # For titles like 'Other Artist - Song', from another artist than the track
+
+DURATION_REGEX = re.compile(r'^P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?$')
+FEATURING_REGEX = re.compile(r'\b(?:ft|feat|featuring)\b\.?')
+NOISE_REGEX = re.compile(r'\b(?:official|music|video|audio|lyrics?|hd|hq|4k|visuali[sz]er)\b')
+PUNCTUATION_REGEX = re.compile(r'[^\w\s]+')
+VERSION_WORDS = ('live', 'cover', 'remix', 'karaoke', 'instrumental', 'acoustic', 'sped', 'slowed', 'nightcore', '8d')
+
+
+def parse_duration(text):
+    """Parse an ISO 8601 duration like 'PT3M25S', as used by the YouTube Data API, to seconds."""
+    match = DURATION_REGEX.match(text or '')
+    if match is None:
+        return None
+    days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def normalize(text):
+    """Decode, lowercase and strip a title, leaving words separated by single spaces."""
+    text = html.unescape(unquote(text)).lower()  # Titles from the API are URL and HTML encoded
+    text = FEATURING_REGEX.sub(' ', text)
+    text = NOISE_REGEX.sub(' ', PUNCTUATION_REGEX.sub(' ', text))
+    return ' '.join(text.split())
+
+
+@functools.lru_cache(maxsize=4096)
+def words_pattern(words):
+    """Compiled pattern matching words as whole words, cached as the same artists and names come by often."""
+    return re.compile(rf'\b{re.escape(words)}\b')
+
+
+def contains(text, words):
+    """Whether words occur in a normalized text as whole words, so 'go' is not found in 'gorillaz'."""
+    return bool(words) and words_pattern(words).search(text) is not None
+
+
+def title_artist(title):
+    """The normalized first part of a title like 'Artist - Song', or None for titles without a dash."""
+    parts = html.unescape(unquote(title)).split(' - ', 1)
+    return normalize(parts[0]) if len(parts) == 2 else None
+
+
+def title_score(name, title, artists):
+    """How well the track name matches the title, with the artist names removed from the title."""
+    if contains(title, name):
+        return 1
+    for artist in artists:
+        title = words_pattern(artist).sub(' ', title) if artist else title
+    return SequenceMatcher(None, name, ' '.join(title.split())).ratio()
+
+
+def wrong_artist(name, artists, title):
+    """
+    Whether a title like 'Artist - Song' names another artist than the
+    track. The first part can also be the song, like in 'Song - Artist'.
+    """
+    first = title_artist(title)
+    if not first:
+        return False
+    return not contains(first, name) and not any(contains(first, artist) for artist in artists)
+
+
+def channel_score(channel, artists):
+    """
+    How official the channel looks: YouTube's auto-generated 'Artist - Topic'
+    channels carry the studio recordings, followed by VEVO and artist channels.
+    """
+    if channel.endswith(' - Topic'):
+        return 1
+    channel = normalize(channel)
+    if channel.replace(' ', '') in [artist.replace(' ', '') for artist in artists]:
+        return 0.9
+    if 'vevo' in channel:
+        return 0.8
+    return 0.4
+
+
+def score(track, result, duration=None):
+    """
+    Score a search result as match for a Spotify track, from 0 to 1.
+
+    The track is a Spotify track object with name, artists and duration_ms.
+    The result is a search result of the YouTube Data API, the duration of its
+    video in seconds is optional. Without it the other parts weigh more.
+    """
+    name = normalize(track['name'])
+    artists = [normalize(artist['name']) for artist in track['artists']]
+    title = normalize(result['video_title'])
+    channel = result.get('channel_title') or ''
+
+    parts = [
+        (TITLE_WEIGHT, title_score(name, title, artists)),
+        (ARTIST_WEIGHT, 1 if any(contains(title, artist) or contains(normalize(channel), artist) for artist in artists) else 0),
+        (CHANNEL_WEIGHT, channel_score(channel, artists)),
+    ]
+    if duration is not None and track.get('duration_ms'):
+        difference = abs(duration - track['duration_ms'] / 1000)
+        parts.append((DURATION_WEIGHT, max(0, 1 - difference / DURATION_TOLERANCE)))
+
+    total = sum(weight * value for weight, value in parts) / sum(weight for weight, _ in parts)
+    name_words = set(name.split())
+    total -= VERSION_PENALTY * sum(1 for word in VERSION_WORDS if word in title.split() and word not in name_words)
+    if wrong_artist(name, artists, result['video_title']):
+        total -= WRONG_ARTIST_PENALTY
+    return max(total, 0)
+
+
+def best_match(track, results, durations=None):
+    """
+    Return the id of the search result that matches a track best, or None
+    if no result scores at least MIN_SCORE. Durations map video ids to seconds.
+    """
+    durations = durations or {}
+    scored = [(score(track, result, durations.get(result['video_id'])), result['video_id']) for result in results]
+    scored = [(value, video_id) for value, video_id in scored if value >= MIN_SCORE]
+    if not scored:
+        return None
+    return max(scored, key=lambda item: item[0])[1]
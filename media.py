@@ -0,0 +1,54 @@
+# Youtube-downloader
+#
+# Cheap checks of the type of downloaded media files. The type is sniffed
+# from the first bytes of a file, libmagic is only used for files that are
+# not recognized, with one handle that is loaded when it is first needed.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+import functools
+import threading
+
+MEDIA_MIME_TYPES = ('video/mp4', 'audio/mp4', 'video/webm', 'audio/webm')
+HEADER_SIZE = 64  # Bytes read from a file to sniff its type
+
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'  # WebM and Matroska
+AUDIO_BRANDS = (b'M4A ', b'M4B ')  # Major brands of mp4 files with only audio
+
+_magic_lock = threading.Lock()
+
+
+def sniff(header):
+    """Return the MIME type of media from its first bytes, or None if they are not recognized."""
+    if header[4:8] == b'ftyp':
+        return 'audio/mp4' if header[8:12] in AUDIO_BRANDS else 'video/mp4'
+    if header.startswith(EBML_MAGIC):
+        return 'video/webm' if b'webm' in header else 'video/x-matroska'
+    if header.startswith(b'ID3') or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return 'audio/mpeg'
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def magic_handle():
+    """The libmagic handle of the process. Loading its database is slow, so it is done once."""
+    import magic
+
+    return magic.Magic(mime=True)
+
+
+def mime_type(path):
+    """Return the MIME type of a file: sniffed from its header, or found by libmagic for other files."""
+    with open(path, 'rb') as file:
+        header = file.read(HEADER_SIZE)
+    mime = sniff(header)
+    if mime is None:
+        with _magic_lock:  # A handle cannot be used by several threads at once
+            mime = magic_handle().from_file(path)
+    return mime
+
+
+def is_media(path):
+    """Check if a file is audio or video that can be converted to mp3."""
+    return mime_type(path) in MEDIA_MIME_TYPES
@@ -0,0 +1,166 @@
+# Youtube-downloader
+#
+# Timing spans and counters for the stages of a download, so it is visible
+# where the time goes per item. They can be written as JSON or in the text
+# format of Prometheus, and a run can be profiled with cProfile.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+import contextlib
+import json
+import sys
+import threading
+import time
+
+PREFIX = 'youtube_downloader'  # Prefix of the Prometheus metric names
+
+
+class Metrics:
+    """
+    Thread-safe timing spans and counters. A span records how often a stage
+    ran and how long it took in total and at most, counters add up values
+    like bytes received, retries or cache hits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self.spans = {}  # Stage name to [count, total seconds, max seconds]
+            self.counters = {}
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        """Time the code in the with block as a run of stage, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds, count=1):
+        """Record count runs of a stage that took seconds together."""
+        with self._lock:
+            span = self.spans.setdefault(stage, [0, 0.0, 0.0])
+            span[0] += count
+            span[1] += seconds
+            span[2] = max(span[2], seconds / count if count else 0)
+
+    def count(self, name, value=1):
+        """Add value to a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        """Return everything recorded as a dictionary, in the format of the JSON export."""
+        with self._lock:
+            return {
+                'spans': {
+                    stage: {'count': count, 'seconds': seconds, 'max_seconds': maximum}
+                    for stage, (count, seconds, maximum) in sorted(self.spans.items())
+                },
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def merge(self, snapshot):
+        """Add a snapshot of another Metrics, for example one recorded in a Transcoder process."""
+        with self._lock:
+            for stage, values in snapshot['spans'].items():
+                span = self.spans.setdefault(stage, [0, 0.0, 0.0])
+                span[0] += values['count']
+                span[1] += values['seconds']
+                span[2] = max(span[2], values['max_seconds'])
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Everything recorded in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            f'# HELP {PREFIX}_stage_seconds Time spent per download stage.',
+            f'# TYPE {PREFIX}_stage_seconds summary',
+        ]
+        for stage, values in snapshot['spans'].items():
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {values["seconds"]:.6f}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+        lines.append(f'# TYPE {PREFIX}_stage_seconds_max gauge')
+        for stage, values in snapshot['spans'].items():
+            lines.append(f'{PREFIX}_stage_seconds_max{{stage="{stage}"}} {values["max_seconds"]:.6f}')
+        for name, value in snapshot['counters'].items():
+            lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+            lines.append(f'{PREFIX}_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write everything recorded to a file: Prometheus text for .prom and .txt files, JSON otherwise."""
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w') as file:
+            file.write(text)
+
+
+# The metrics of the process, recorded by all downloads
+metrics = Metrics()
+
+
+def measured(function, *args):
+    """
+    Call function(*args) in a worker process and return its result together
+    with the metrics it recorded, so the parent process can merge them.
+    """
+    metrics.reset()
+    return function(*args), metrics.snapshot()
+
+
+class Profiler:
+    """
+    cProfile for a whole run, including the worker threads started during it.
+    Since Python 3.12 a profile covers all threads, and only one can be
+    enabled at a time. On older versions every thread gets a profile of its
+    own, they are combined by dump. Transcoder processes are not profiled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = []
+
+    def start(self):
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._start_thread)
+        self._enable()
+
+    def stop(self):
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        self._profiles[0].disable()
+
+    def _start_thread(self, frame, event, arg):
+        sys.setprofile(None)
+        self._enable()
+
+    def _enable(self):
+        import cProfile
+
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def dump(self, path):
+        """Write the combined profile to a file, to be read with pstats or a viewer like snakeviz."""
+        import pstats
+
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            profile.create_stats()
+            if profile.stats:
+                stats.add(profile)
+        stats.dump_stats(path)
@@ -0,0 +1,336 @@
+# Youtube-downloader
+#
+# Network code of the downloader: a shared HTTP session with connection
+# pooling, and resumable, chunked HTTP downloads.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+from storage import cache_directory
+from urllib.error import HTTPError
+import contextlib
+import errno
+import importlib.util
+import json
+import os
+import re
+import threading
+
+CHUNK_SIZE = 9 * 1024 * 1024  # YouTube throttles requests for larger ranges
+READ_SIZE = 64 * 1024
+TIMEOUT = 30
+POOL_SIZE = 32
+PLAYER_JS_REGEX = re.compile(r'/s/player/([\w\-]+)/')
+CONTENT_RANGE_REGEX = re.compile(r'bytes \d+-\d+/(\d+)')
+
+
+class DownloadCancelled(Exception):
+    """Raised when a download is stopped. The partial file is kept for resuming."""
+
+
+class RangeNotSupported(Exception):
+    """Raised when a server ignores the Range header of a request."""
+
+
+class Response:
+    """A streamed HTTP response, the body is read from chunks."""
+
+    def __init__(self, status, headers, chunks):
+        self.status = status
+        self.headers = headers
+        self.chunks = chunks
+
+    def read(self):
+        """Read the whole body."""
+        return b''.join(self.chunks)
+
+    def info(self):
+        """The headers, like urllib responses have them."""
+        return self.headers
+
+
+class Session:
+    """
+    HTTP client with keep-alive connection pooling, so requests to the same
+    host reuse their TCP and TLS connections. Uses HTTP/2 when the httpx and
+    h2 packages are installed, and requests otherwise.
+
+    Errors are raised as urllib.error.HTTPError, like urllib does.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE):
+        if importlib.util.find_spec('httpx') is None or importlib.util.find_spec('h2') is None:
+            import requests
+            self.http2 = False
+            self._client = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self._client.mount('http://', adapter)
+            self._client.mount('https://', adapter)
+        else:
+            import httpx
+            self.http2 = True
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            self._client = httpx.Client(http2=True, limits=limits, timeout=TIMEOUT, follow_redirects=True)
+
+    @contextlib.contextmanager
+    def request(self, method, url, headers=None, data=None):
+        """Send a request and yield the streamed Response. The connection is released afterwards."""
+        if self.http2:
+            with self._client.stream(method, url, headers=headers, content=data) as response:
+                self._check(url, response.status_code, response.headers)
+                yield Response(response.status_code, response.headers, response.iter_bytes(READ_SIZE))
+        else:
+            response = self._client.request(method, url, headers=headers, data=data, stream=True, timeout=TIMEOUT)
+            try:
+                self._check(url, response.status_code, response.headers)
+                yield Response(response.status_code, response.headers, response.iter_content(READ_SIZE))
+            finally:
+                response.close()
+
+    def get(self, url, timeout=TIMEOUT):
+        """
+        Send a GET request and return the response of the client, read in full.
+        Has the signature of requests.Session.get, for libraries that take a session.
+        """
+        return self._client.get(url, timeout=timeout)
+
+    def _check(self, url, status, headers):
+        if status >= 400:
+            raise HTTPError(url, status, f"HTTP Error {status}", headers, None)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """Return the HTTP session shared by the whole process."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+        return _session
+
+
+@contextlib.contextmanager
+def request_range(url, start, end):
+    """Request bytes start to end (inclusive) of a url."""
+    with session().request('GET', url, {'Range': f'bytes={start}-{end}'}) as response:
+        yield response
+
+
+def total_size(response):
+    """Get the total size of a resource from the Content-Range header of a response."""
+    match = CONTENT_RANGE_REGEX.match(response.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else None
+
+
+class PlayerCache:
+    """
+    Cache of YouTube's player JavaScript, which pytube needs to decipher stream
+    urls. It only changes with the player version, so it is kept in memory and
+    on disk per version instead of being fetched again for every video.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scripts = {}
+
+    def get(self, version, fetch):
+        """Return the script of a player version, calling fetch() if it is not cached."""
+        with self._lock:
+            if version in self._scripts:
+                metrics.count('player_cache_hits')
+                return self._scripts[version]
+
+        path = os.path.join(cache_directory(), f'player-{version}.js')
+        if os.path.isfile(path):
+            metrics.count('player_cache_hits')
+            with open(path, 'rb') as file:
+                script = file.read()
+        else:
+            metrics.count('player_cache_misses')
+            script = fetch()
+            with open(path + '.tmp', 'wb') as file:
+                file.write(script)
+            os.replace(path + '.tmp', path)
+
+        with self._lock:
+            self._scripts[version] = script
+        return script
+
+
+player_cache = PlayerCache()
+
+
+def install_pytube_transport():
+    """
+    Send the requests of pytube (watch pages, player JavaScript and the
+    innertube API) through the shared session instead of a new urllib
+    connection per request, with the player JavaScript cached per version.
+    Calling this more than once has no effect.
+    """
+    import pytube.request
+
+    if getattr(pytube.request, 'shared_session', False):
+        return
+
+    def execute_request(url, method=None, headers=None, data=None, timeout=None):
+        all_headers = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+        all_headers.update(headers or {})
+        if data and not isinstance(data, bytes):
+            data = json.dumps(data).encode('utf-8')
+        method = method or ('POST' if data else 'GET')
+
+        def fetch():
+            with session().request(method, url, all_headers, data) as response:
+                return Response(response.status, dict(response.headers), [response.read()])
+
+        match = PLAYER_JS_REGEX.search(url)
+        if match and method == 'GET':
+            return Response(200, {}, [player_cache.get(match.group(1), lambda: fetch().read())])
+        return fetch()
+
+    pytube.request._execute_request = execute_request
+    pytube.request.shared_session = True
+
+
+def copy_response(response, file, stopped, on_progress):
+    """Copy the body of a response to a file. Returns the number of bytes written."""
+    written = 0
+    for data in response.chunks:
+        if stopped is not None and stopped():
+            raise DownloadCancelled()
+        file.write(data)
+        written += len(data)
+        if on_progress is not None:
+            on_progress(len(data))
+    return written
+
+
+def preallocate(file, size):
+    """
+    Allocate the disk space for a file of size bytes up front, so a download
+    is not fragmented and a full disk is noticed before downloading. Falls
+    back to a sparse file where the platform or filesystem cannot allocate.
+    """
+    try:
+        os.posix_fallocate(file.fileno(), 0, size)
+    except AttributeError:
+        file.truncate(size)  # Not available on Windows and macOS
+    except OSError as error:
+        if error.errno not in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS):
+            raise
+        file.truncate(size)
+
+
+def download_file(url, path, filesize=None, segments=1, stopped=None, on_progress=None, part=None):
+    """
+    Download a url to path, in chunks requested with HTTP Range headers.
+
+    Data is written to part (default path + '.part') and moved to path when
+    the download is complete, so an interrupted or cancelled download resumes
+    where it stopped. When the filesize is known the part file is preallocated,
+    and the download can be split in several segments that are downloaded in
+    parallel. The stopped callable is polled to cancel the download,
+    on_progress is called with the number of bytes received.
+    """
+    part = part or path + '.part'
+    if filesize:
+        try:
+            download_segments(url, part, filesize, max(1, segments), stopped, on_progress)
+        except RangeNotSupported:
+            os.remove(part)
+            os.remove(part + '.json')
+            download_sequential(url, part, filesize, stopped, on_progress)
+    else:
+        download_sequential(url, part, filesize, stopped, on_progress)
+    os.replace(part, path)
+    return path
+
+
+def download_sequential(url, part, filesize, stopped, on_progress):
+    """Download a url chunk by chunk, appending to the part file. Progress is the size of the part file."""
+    position = os.path.getsize(part) if os.path.exists(part) else 0
+    with open(part, 'ab') as file:
+        copy_url(url, file, position, filesize, stopped, on_progress)
+
+
+def copy_url(url, file, position=0, filesize=None, stopped=None, on_progress=None):
+    """
+    Copy a url from position to the end into a file object, in chunks
+    requested with HTTP Range headers. The file can be a pipe, like the stdin
+    of a process, as long as the server does not ignore the Range header.
+    """
+    while filesize is None or position < filesize:
+        end = position + CHUNK_SIZE - 1
+        if filesize is not None:
+            end = min(end, filesize - 1)
+
+        try:
+            with request_range(url, position, end) as response:
+                if response.status != 206:  # Range ignored, the whole file is sent
+                    if position > 0:
+                        if not file.seekable():
+                            raise RangeNotSupported(url)
+                        file.seek(0)
+                        file.truncate()
+                    copy_response(response, file, stopped, on_progress)
+                    return
+                if filesize is None:
+                    filesize = total_size(response)
+                position += copy_response(response, file, stopped, on_progress)
+        except HTTPError as error:
+            if error.code == 416:
+                return  # Requested range starts at the end of the file
+            raise
+
+        if filesize is None:
+            return  # Server does not tell the size, assume everything was sent
+
+
+def download_segments(url, part, filesize, segments, stopped, on_progress):
+    """
+    Download a url in segments on parallel threads, writing into a preallocated
+    part file. Progress of each segment is recorded in a json file next to it.
+    """
+    state_path = part + '.json'
+    segment_size = -(-filesize // segments)
+    starts = list(range(0, filesize, segment_size))
+    done = dict.fromkeys(starts, 0)
+
+    if os.path.exists(part) and os.path.exists(state_path) and os.path.getsize(part) == filesize:
+        with open(state_path) as state_file:
+            done.update({int(start): size for start, size in json.load(state_file).items()})
+    else:
+        with open(part, 'wb') as file:
+            preallocate(file, filesize)
+
+    lock = threading.Lock()
+
+    def save_state():
+        with open(state_path, 'w') as state_file:
+            json.dump(done, state_file)
+
+    def download_segment(start):
+        end = min(start + segment_size, filesize) - 1
+        position = start + done[start]
+        with open(part, 'r+b') as file:
+            while position <= end:
+                with request_range(url, position, min(position + CHUNK_SIZE - 1, end)) as response:
+                    if response.status != 206:
+                        raise RangeNotSupported(url)
+                    file.seek(position)
+                    position += copy_response(response, file, stopped, on_progress)
+                with lock:
+                    done[start] = position - start
+                    save_state()
+
+    with lock:
+        save_state()
+    with ThreadPoolExecutor(max_workers=segments, thread_name_prefix="Segment") as pool:
+        for future in [pool.submit(download_segment, start) for start in starts]:
+            future.result()
+    os.remove(state_path)
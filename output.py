@@ -0,0 +1,136 @@
+# Youtube-downloader
+#
+# Placement of downloaded files in the target directory. Files are written
+# in a temporary directory next to them and only appear in the target
+# directory when they are complete.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+import os
+import shutil
+import threading
+
+TEMP_DIRECTORY = '.youtube_downloader.tmp'
+CLAIMS_DIRECTORY = 'claims'  # In the temporary directory, a file per claimed name
+SPACE_MARGIN = 64 * 1024 * 1024  # Bytes left free on the disk when downloading
+
+
+class InsufficientSpace(Exception):
+    """Raised when the target directory has not enough free space for a download."""
+
+
+class OutputDirectory:
+    """
+    The target directory of a Downloader. Files are written in a temporary
+    directory inside it, so on the same filesystem, and moved to their final
+    name with an atomic rename when they are complete. A file in the target
+    directory is therefore never partially written.
+
+    Temporary files are named after the video id, so an interrupted download
+    resumes at the next run. Final names are the titles of the videos, when a
+    title is taken by another file the video id is appended to it. Of videos
+    with the same title, the one whose download claims the name first gets
+    the plain title, so which one that is can differ between runs. The
+    DownloadIndex records the path of every video.
+
+    Names are claimed with a file in the temporary directory, created with
+    O_EXCL, so downloaders in other processes or on other hosts that write
+    to the same directory never pick the same name for different videos.
+    A claim reserves the size of its download until it is released, so
+    parallel downloads do not count on the same free space.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.temp = os.path.join(target, TEMP_DIRECTORY)
+        self.claims = os.path.join(self.temp, CLAIMS_DIRECTORY)
+        os.makedirs(self.claims, exist_ok=True)
+        self._lock = threading.Lock()
+        self._claimed = {}  # Claimed paths to the bytes reserved for them
+        self.reserved = 0
+
+    def claim(self, video_id, filename, size=0):
+        """
+        Return the final path for the file of a video and reserve size bytes
+        for it. The filename is used unless it exists or is claimed by a
+        running download of another video, then it becomes
+        'name [video id].ext'. Raises InsufficientSpace if the size does not
+        fit, see check_space. Release the path when the download is done.
+        """
+        with self._lock:
+            self._check_space(size)
+            self.reserved += size
+        try:
+            if not self._claim_name(video_id, filename):
+                name, extension = os.path.splitext(filename)
+                filename = f'{name} [{video_id}]{extension}'
+                self._claim_name(video_id, filename)  # Only this video uses this name
+        except BaseException:
+            with self._lock:
+                self.reserved -= size
+            raise
+        path = os.path.join(self.target, filename)
+        with self._lock:
+            self._claimed[path] = size
+        return path
+
+    def _claim_name(self, video_id, filename):
+        """Create the claim file of a name. Returns False if the file exists or is claimed for another video."""
+        claim = os.path.join(self.claims, filename)
+        try:
+            descriptor = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileNotFoundError:  # Removed by another downloader of the directory that closed
+            os.makedirs(self.claims, exist_ok=True)
+            return self._claim_name(video_id, filename)
+        except FileExistsError:
+            try:
+                with open(claim) as file:
+                    return file.read() == video_id  # Left by an interrupted download of the same video
+            except FileNotFoundError:
+                return False  # Released meanwhile, the file is in place now
+        with os.fdopen(descriptor, 'w') as file:
+            file.write(video_id)
+        if os.path.exists(os.path.join(self.target, filename)):  # Checked after claiming, files are released when in place
+            os.remove(claim)
+            return False
+        return True
+
+    def release(self, path):
+        """Release a path claimed with claim."""
+        with self._lock:
+            self.reserved -= self._claimed.pop(path, 0)
+        try:
+            os.remove(os.path.join(self.claims, os.path.basename(path)))
+        except FileNotFoundError:
+            pass
+
+    def temp_path(self, video_id, extension):
+        """Path in the temporary directory for a file of a video, like '<temp>/<video id>.mp4'."""
+        os.makedirs(self.temp, exist_ok=True)  # In case another downloader of the directory removed it
+        return os.path.join(self.temp, video_id + extension)
+
+    def check_space(self, size):
+        """Raise InsufficientSpace if size bytes do not fit in the target directory next to the reserved bytes."""
+        with self._lock:
+            self._check_space(size)
+
+    def _check_space(self, size):
+        free = shutil.disk_usage(self.target).free
+        if size + self.reserved + SPACE_MARGIN > free:
+            raise InsufficientSpace(
+                f"Not enough free space in {self.target}: {size / 1e6:.0f} MB needed, "
+                f"{free / 1e6:.0f} MB free of which {self.reserved / 1e6:.0f} MB reserved for running downloads."
+            )
+
+    def close(self):
+        """Release all claims and remove the temporary directory if no download left files in it."""
+        with self._lock:
+            claimed = list(self._claimed)
+        for path in claimed:
+            self.release(path)
+        try:
+            os.rmdir(self.claims)
+            os.rmdir(self.temp)
+        except OSError:
+            pass  # Not empty, interrupted downloads resume later, other downloaders still run
@@ -0,0 +1,287 @@
+# Youtube-downloader
+#
+# Pipeline that finds the tracks of a Spotify playlist on YouTube and
+# downloads them. It is only imported when a playlist is downloaded, as
+# asyncio takes a while to load.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from concurrent.futures import ThreadPoolExecutor
+from engine import DURATIONS_BATCH, PAGE_SIZE, REQUEUES, DownloadCounter
+from matching import best_match
+from metrics import metrics
+from network import DownloadCancelled
+from scheduler import is_fatal, is_transient
+import asyncio
+
+
+class SpotifyPipeline:
+    """
+    Resolves and downloads the tracks of a Spotify playlist in three asyncio
+    stages, connected by queues: fetching pages of the playlist, searching
+    the tracks on YouTube and downloading the videos. The pages are fetched
+    concurrently, and the duration lookups of the searchers are batched.
+    Blocking calls run in a thread pool, the stages only pass on results.
+
+    Errors in a stage are collected and raised by run after the pipeline
+    has drained, so a failing stage never blocks the others. Only fatal
+    errors, like a full disk, stop the pipeline, other errors fail the track
+    they were raised for. Calls to Spotify and YouTube are rate limited and
+    retried by the scheduler of the downloader. Searches and downloads that
+    still fail with a transient error are tried again after all other
+    tracks, at most REQUEUES times.
+    """
+    QUEUE_SIZE = 100
+    SEARCHERS = DURATIONS_BATCH // 5  # So the 5 results of each searcher fill a duration lookup
+    PAGE_FETCHERS = 4
+    DURATIONS_DELAY = 0.5  # Seconds a duration lookup waits for the lookups of other searchers
+
+    def __init__(self, downloader, spotify, playlist, resolutions):
+        self.downloader = downloader
+        self.spotify = spotify
+        self.playlist = playlist
+        self.resolutions = resolutions
+        self.counter = DownloadCounter('downloaded', 'not_found', 'failed')
+        self.errors = []
+        self.requeued = []  # Resolved tracks to download again
+        self.requeued_tracks = []  # Tracks to search again
+        self.pending_durations = []  # (video ids, future) of the duration lookups waiting for a batch
+        self.flush_handle = None
+
+    def run(self):
+        """Run the pipeline until all tracks are processed or the downloader is stopped."""
+        asyncio.run(self.main())
+        if self.errors:
+            raise self.errors[0]
+
+    def halted(self):
+        """Check if the stages should stop doing work and only drain their queues."""
+        return self.downloader.stopped() or bool(self.errors)
+
+    async def main(self):
+        workers = self.downloader.workers
+        self.executor = ThreadPoolExecutor(max_workers=workers + self.SEARCHERS + self.PAGE_FETCHERS)
+        tracks = asyncio.Queue()  # Unbounded, so the playlist is listed in seconds
+        resolved = asyncio.Queue(self.QUEUE_SIZE)
+        searchers = [asyncio.ensure_future(self.search(tracks, resolved)) for _ in range(self.SEARCHERS)]
+        downloaders = [asyncio.ensure_future(self.download(resolved)) for _ in range(workers)]
+
+        try:
+            await self.fetch_pages(tracks)
+            for _ in searchers:
+                await tracks.put(None)
+            await asyncio.gather(*searchers)
+            await self.retry_searches(resolved)
+            for _ in downloaders:
+                await resolved.put(None)
+            await asyncio.gather(*downloaders)
+            await self.retry_downloads()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    async def call(self, function, *args):
+        """Run a blocking function in the thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def retry_searches(self, resolved):
+        """Search the requeued tracks again, at the back of the queue. Downloads go on meanwhile."""
+        for _ in range(REQUEUES):
+            tracks, self.requeued_tracks = self.requeued_tracks, []
+            if not tracks or self.halted():
+                break
+            queue = asyncio.Queue()
+            for track in tracks + [None] * self.SEARCHERS:
+                queue.put_nowait(track)
+            await asyncio.gather(*[self.search(queue, resolved) for _ in range(self.SEARCHERS)])
+        for _ in self.requeued_tracks:
+            self.downloader.bus.publish('counts', self.counter.add('failed'))
+
+    def fail(self, item, error):
+        """Handle the error of a track that is not requeued: fatal errors stop the pipeline, others fail the track."""
+        if is_fatal(error):
+            self.errors.append(error)
+        else:
+            self.downloader.failed(item, error)
+            self.downloader.bus.publish('counts', self.counter.add('failed'))
+
+    async def retry_downloads(self):
+        """Download the requeued tracks again, at the back of the queue."""
+        workers = self.downloader.workers
+        for _ in range(REQUEUES):
+            items, self.requeued = self.requeued, []
+            if not items or self.halted():
+                break
+            resolved = asyncio.Queue()
+            for item in items + [None] * workers:
+                resolved.put_nowait(item)
+            await asyncio.gather(*[self.download(resolved) for _ in range(workers)])
+        for _ in self.requeued:
+            self.downloader.bus.publish('counts', self.counter.add('failed'))
+
+    def get_tracks(self, offset):
+        """Get the next PAGE_SIZE tracks from the playlist, starting from the offset."""
+        with metrics.span('playlist_page'):
+            return self.spotify.playlist_items(
+                self.playlist['id'],
+                fields=('items(track(id,name,duration_ms,artists(name))),next'),
+                limit=PAGE_SIZE,
+                offset=offset,
+                additional_types=('track',)
+            )
+
+    async def fetch_page(self, offset, fetchers):
+        """Fetch a page of the playlist when one of the fetchers is free. Returns None when halted."""
+        async with fetchers:
+            if self.halted():
+                return None
+            return await self.call(self.downloader.scheduler.call, 'spotify', self.get_tracks, offset)
+
+    async def fetch_pages(self, tracks):
+        """
+        First stage: put the tracks of all playlist pages in the tracks queue.
+        The number of tracks is known up front, so all pages are requested
+        concurrently (at most PAGE_FETCHERS at a time, within the rate limit
+        of Spotify), and their tracks are queued in playlist order. Pages that
+        were added after the playlist was looked up are fetched at the end.
+        """
+        fetchers = asyncio.Semaphore(self.PAGE_FETCHERS)
+        offsets = range(0, self.playlist['tracks']['total'], PAGE_SIZE)
+        pages = [asyncio.ensure_future(self.fetch_page(offset, fetchers)) for offset in offsets]
+        offset = len(pages) * PAGE_SIZE
+        page = None
+        try:
+            for future in pages:
+                page = await future
+                if page is None:
+                    return
+                await self.queue_tracks(page, tracks)
+            while page is not None and page['next']:
+                page = await self.fetch_page(offset, fetchers)
+                if page is not None:
+                    await self.queue_tracks(page, tracks)
+                offset += PAGE_SIZE
+        except Exception as error:
+            self.errors.append(error)
+        finally:
+            for future in pages:
+                future.cancel()
+
+    async def queue_tracks(self, page, tracks):
+        """
+        Put the tracks of a page in the tracks queue. Removed or unavailable
+        tracks are null in the playlist, they are counted as not found, as
+        None in the queue is the signal for the searchers to stop.
+        """
+        for item in page['items']:
+            if item.get('track') is None:
+                self.downloader.bus.publish('counts', self.counter.add('not_found'))
+            else:
+                await tracks.put(item['track'])
+
+    async def search(self, tracks, resolved):
+        """Second stage: find the best matching video for tracks, with a rate limit on searches."""
+        while True:
+            track = await tracks.get()
+            if track is None:
+                return
+            if self.halted():
+                continue
+
+            try:
+                artist = track['artists'][0]['name']
+                key = track['id'] or f"{artist} - {track['name']}"  # Local files have no id
+                cached, video_id = await self.call(self.resolutions.get, key)
+                metrics.count('resolution_cache_hits' if cached else 'resolution_cache_misses')
+                if not cached:
+                    video_id = await self.find_match(track)
+            except Exception as error:
+                if is_transient(error):
+                    self.requeued_tracks.append(track)
+                else:
+                    self.fail(track.get('name'), error)
+                continue
+            await resolved.put((key, video_id, cached))
+
+    async def find_match(self, track):
+        """Return the id of the video that matches a track best in its top 5 YouTube results, or None."""
+        results = await self.call(self.downloader.search_track, track)
+        if not results:
+            return None
+        durations = await self.durations([result['video_id'] for result in results])
+        with metrics.span('match'):
+            return best_match(track, results, durations)
+
+    async def durations(self, video_ids):
+        """
+        Look up the durations of videos in seconds. The lookups of the searchers
+        are collected until all searchers are waiting, DURATIONS_BATCH ids are
+        collected or DURATIONS_DELAY has passed, and made in a single call.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending_durations.append((video_ids, future))
+        waiting = sum(len(ids) for ids, _ in self.pending_durations)
+        if waiting >= DURATIONS_BATCH or len(self.pending_durations) >= self.SEARCHERS:
+            self.flush_durations()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.DURATIONS_DELAY, self.flush_durations)
+        return await future
+
+    def flush_durations(self):
+        """Start the lookup of the collected durations."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.pending_durations = self.pending_durations, []
+        asyncio.ensure_future(self.fetch_durations(pending))
+
+    async def fetch_durations(self, pending):
+        """Fetch the durations of a batch of lookups and pass them to the waiting searchers."""
+        video_ids = list(dict.fromkeys(video_id for ids, _ in pending for video_id in ids))
+        durations = {}
+        try:
+            for start in range(0, len(video_ids), DURATIONS_BATCH):
+                batch = video_ids[start:start + DURATIONS_BATCH]
+                durations.update(await self.call(
+                    self.downloader.scheduler.call, 'search', self.downloader.video_durations, batch))
+        except Exception as error:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for _, future in pending:
+            if not future.done():
+                future.set_result(durations)
+
+    async def download(self, resolved):
+        """Third stage: download the matched video of each track."""
+        while True:
+            item = await resolved.get()
+            if item is None:
+                return
+            if self.halted():
+                continue
+
+            key, found, cached = item
+            try:
+                video_id = await self.call(self.fetch, found)
+            except DownloadCancelled:
+                continue
+            except Exception as error:
+                if is_transient(error):
+                    self.requeued.append(item)
+                else:
+                    self.fail(found, error)
+                continue
+            if not cached or video_id != found:  # Hits keep their expiry, so unfound tracks are retried
+                await self.call(self.resolutions.put, key, video_id)
+            self.downloader.bus.publish('counts', self.counter.add('downloaded' if video_id else 'not_found'))
+
+    def fetch(self, video_id):
+        """
+        Download the matched video of a track, runs in the thread pool.
+        Returns the id of the video, or None if there is no match or it is not available.
+        """
+        if video_id is not None and self.downloader.download_video(video_id) == 'downloaded':
+            return video_id
+        return None
@@ -0,0 +1,125 @@
+# Youtube-downloader
+#
+# Progress reporting from download threads to the GUI or the console.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+import queue
+import time
+
+
+class ProgressBus:
+    """
+    Carries progress events from worker threads to a single receiving thread.
+    Workers publish events without blocking, the receiver drains the queue at
+    its own pace (for the GUI: at a fixed frame rate in the Tk main loop).
+
+    Events are (kind, value) tuples. The kinds used by the engine are
+    'total' (number of items), 'counts' (snapshot of the DownloadCounter),
+    'expected' (size of a stream that will be downloaded, published when it
+    is resolved) and 'bytes' (bytes received). Per item there are 'item'
+    (video id, name and size, when its download starts), 'item_bytes' (video
+    id and bytes received) and 'item_done' (video id, also when it failed).
+    'error' describes an item that failed, the download goes on. Frontends add their own kinds, like 'status'.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def publish(self, kind, value=None):
+        """Publish an event, safe to call from any thread."""
+        self._queue.put((kind, value))
+
+    def drain(self, limit=10000):
+        """Return the pending events, at most limit of them so a burst cannot stall the receiver."""
+        events = []
+        try:
+            while len(events) < limit:
+                events.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+
+class ProgressState:
+    """Progress of a download job, built up from the events of a ProgressBus."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.total = None
+        self.counts = {}
+        self.streams_expected = 0
+        self.bytes_expected = 0
+        self.bytes_received = 0
+        self.items = {}  # Running downloads by video id: [name, size, bytes received]
+
+    def apply(self, kind, value):
+        """Apply an engine event. Returns False for events of other kinds."""
+        if kind == 'total':
+            self.total = value
+        elif kind == 'counts':
+            self.counts = value
+        elif kind == 'expected':
+            self.streams_expected += 1
+            self.bytes_expected += value
+        elif kind == 'bytes':
+            self.bytes_received += value
+        elif kind == 'item':
+            video_id, name, size = value
+            self.items[video_id] = [name, size, 0]
+        elif kind == 'item_bytes':
+            if value[0] in self.items:
+                self.items[value[0]][2] += value[1]
+        elif kind == 'item_done':
+            self.items.pop(value, None)
+        else:
+            return False
+        return True
+
+    def throughput(self):
+        """Average download speed in bytes per second."""
+        elapsed = time.monotonic() - self.started
+        return self.bytes_received / elapsed if elapsed > 0 else 0
+
+    def eta(self):
+        """
+        Estimated number of seconds until all items are done, or None if unknown.
+        Items whose stream is not resolved yet are assumed to have the average
+        size of the resolved streams.
+        """
+        done = sum(self.counts.values())
+        speed = self.throughput()
+        if not self.total or not self.streams_expected or not speed:
+            return None
+        bytes_per_stream = self.bytes_expected / self.streams_expected
+        unresolved = max(self.total - max(self.streams_expected, done), 0)
+        remaining = bytes_per_stream * unresolved + max(self.bytes_expected - self.bytes_received, 0)
+        return remaining / speed
+
+    def describe(self):
+        """Describe the download speed and remaining time, like '1.5 MB/s, 2:05 left'."""
+        text = f"{self.throughput() / 1e6:.1f} MB/s"
+        eta = self.eta()
+        if eta is not None:
+            minutes, seconds = divmod(int(eta), 60)
+            text += f", {minutes}:{seconds:02d} left"
+        return text
+
+    def describe_items(self, width=40):
+        """Describe the running downloads, a line per item like 'Title  45% of 12.3 MB', names clipped to width."""
+        lines = []
+        for name, size, received in self.items.values():
+            name = name[:width - 3] + '...' if len(name) > width else name
+            if size:
+                lines.append(f"{name}  {min(received / size, 1):.0%} of {size / 1e6:.1f} MB")
+            else:
+                lines.append(f"{name}  {received / 1e6:.1f} MB")
+        return lines
+
+
+class SilentBus(ProgressBus):
+    """A ProgressBus that drops all events, for downloads nobody is watching."""
+
+    def publish(self, kind, value=None):
+        pass
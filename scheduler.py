@@ -0,0 +1,200 @@
+# Youtube-downloader
+#
+# Rate limits and retries for the calls to YouTube and Spotify, so raising
+# the number of parallel downloads does not get the downloader banned.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from metrics import metrics
+from output import InsufficientSpace
+from urllib.error import URLError
+import errno
+import random
+import sys
+import threading
+import time
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+ATTEMPTS = 5
+BASE_DELAY = 1  # Seconds before the first retry, doubled for every next one
+MAX_DELAY = 60
+
+# Calls per second and burst size per endpoint, None for no limit
+RATES = {
+    'youtube': (10, 5),  # Watch pages and the innertube API, used by pytube
+    'search': (5, 1),  # YouTube Data API searches
+    'spotify': (10, 5),
+    'stream': (None, None),  # Stream data, only retried
+}
+
+
+def http_status(error):
+    """The HTTP status code of an error raised by urllib, requests or spotipy, or None."""
+    for attribute in ('http_status', 'status_code', 'code'):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int) and status >= 100:
+            return status
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def retry_after(error):
+    """The delay in seconds asked for by the Retry-After header of an HTTP error, or None."""
+    headers = getattr(error, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        from email.utils import parsedate_to_datetime
+
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+
+def transient_errors():
+    """
+    The connection, timeout and protocol error types of the HTTP libraries,
+    like a connection that is reset while a body is streamed. Libraries that
+    are not loaded cannot have raised the error, so they are not imported.
+    """
+    import http.client  # Loaded by every HTTP library, only imported here to keep startup fast
+
+    errors = [ConnectionError, TimeoutError, URLError, http.client.HTTPException]
+    requests = sys.modules.get('requests')
+    if requests is not None:
+        errors += [requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError]
+    urllib3 = sys.modules.get('urllib3')
+    if urllib3 is not None:
+        errors.append(urllib3.exceptions.ProtocolError)
+    httpx = sys.modules.get('httpx')
+    if httpx is not None:
+        errors.append(httpx.TransportError)
+    return tuple(errors)
+
+
+def is_transient(error):
+    """Whether an error is likely to go away when the call is retried later."""
+    status = http_status(error)
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(error, transient_errors())
+
+
+def is_fatal(error):
+    """
+    Whether an error stops a whole job instead of failing a single item,
+    like a full disk. Other errors fail the item they were raised for.
+    """
+    if isinstance(error, InsufficientSpace):
+        return True
+    return isinstance(error, OSError) and error.errno in (errno.ENOSPC, errno.EDQUOT)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows rate calls per second on average, in
+    bursts of at most burst calls. The rate adapts to the server: it is halved
+    when the server answers 429 Too Many Requests, and slowly grows back to
+    the configured rate after successful calls.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a call is allowed."""
+        if self.max_rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, delay=None):
+        """Slow down after a 429 response, pausing all calls for delay seconds if given."""
+        if self.max_rate is None:
+            return
+        with self._lock:
+            self.rate = max(self.rate / 2, self.max_rate / 16)
+            if delay:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def succeeded(self):
+        """Speed up again after a successful call."""
+        if self.max_rate is None:
+            return
+        with self._lock:
+            self.rate = min(self.rate + self.max_rate / 20, self.max_rate)
+
+
+# The rate limits are shared by all downloads in the process
+buckets = {endpoint: TokenBucket(rate, burst) for endpoint, (rate, burst) in RATES.items()}
+
+
+class Scheduler:
+    """
+    Makes the calls to an endpoint within its rate limit, and retries calls
+    that fail with a transient error (429, 5xx, connection errors) with
+    exponential backoff and jitter. A Retry-After header is honored.
+    """
+
+    def __init__(self, attempts=ATTEMPTS, stopped=None):
+        self.attempts = attempts
+        self.stopped = stopped or (lambda: False)
+
+    def call(self, endpoint, function, *args):
+        """
+        Call function(*args) within the rate limit of an endpoint, and return
+        its result. The error of the last attempt is raised when all attempts
+        fail, or when the downloader is stopped while waiting for a retry.
+        """
+        bucket = buckets[endpoint]
+        for attempt in range(1, self.attempts + 1):
+            bucket.acquire()
+            try:
+                result = function(*args)
+            except Exception as error:
+                if attempt == self.attempts or not is_transient(error):
+                    raise
+                metrics.count('retries')
+                delay = retry_after(error)
+                if http_status(error) == 429:
+                    metrics.count('throttled')
+                    bucket.throttled(delay)
+                if delay is None:
+                    delay = min(BASE_DELAY * 2 ** (attempt - 1), MAX_DELAY) * random.uniform(0.5, 1.5)
+                if not self.wait(delay):
+                    raise
+            else:
+                bucket.succeeded()
+                return result
+
+    def wait(self, delay):
+        """Sleep for delay seconds. Returns False if the downloader was stopped meanwhile."""
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline:
+            if self.stopped():
+                return False
+            time.sleep(max(min(0.5, deadline - time.monotonic()), 0))
+        return not self.stopped()
@@ -0,0 +1,335 @@
+# Youtube-downloader
+#
+# Persistent storage used by the downloader, kept in small SQLite databases.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def file_checksum(path):
+    """Return the sha256 hex digest of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadIndex:
+    """
+    Index of finished downloads in a target directory, so they are not
+    downloaded again. Entries are keyed by YouTube video id and output
+    format and record the output path, size and checksum of the file.
+
+    The index is shared by worker threads, access is serialized with a lock.
+    """
+    FILENAME = '.youtube_downloader.sqlite'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, self.FILENAME), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            "video_id TEXT NOT NULL, format TEXT NOT NULL, path TEXT NOT NULL, "
+            "size INTEGER NOT NULL, sha256 TEXT NOT NULL, PRIMARY KEY (video_id, format))"
+        )
+        self._db.commit()
+
+    def contains(self, video_id, format):
+        """
+        Check if a video was already downloaded in the given format.
+        Entries whose file was removed or changed size are forgotten.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, size FROM downloads WHERE video_id = ? AND format = ?",
+                (video_id, format)
+            ).fetchone()
+            if row is None:
+                return False
+
+            path = os.path.join(self.directory, row[0])
+            if os.path.isfile(path) and os.path.getsize(path) == row[1]:
+                return True
+
+            self._db.execute("DELETE FROM downloads WHERE video_id = ? AND format = ?", (video_id, format))
+            self._db.commit()
+            return False
+
+    def add(self, video_id, format, path):
+        """Record a finished download."""
+        size = os.path.getsize(path)
+        checksum = file_checksum(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?)",
+                (video_id, format, os.path.relpath(path, self.directory), size, checksum)
+            )
+            self._db.commit()
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._db.close()
+
+
+def cache_directory():
+    """Return the directory for cache files of the downloader, creating it if needed."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    directory = os.path.join(base, 'youtube_downloader')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+class ResolutionCache:
+    """
+    Cache of Spotify tracks resolved to YouTube video ids, so a track is only
+    searched on YouTube once. Tracks that could not be found are cached too
+    (with video id None), but expire sooner so they are retried later.
+
+    Expired entries are evicted when the cache is opened, and the least
+    recently used entries are evicted when it grows beyond max_entries.
+    """
+    FILENAME = 'resolutions.sqlite'
+    TTL = 30 * 24 * 3600
+    NEGATIVE_TTL = 24 * 3600
+
+    def __init__(self, path=None, max_entries=100000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or os.path.join(cache_directory(), self.FILENAME), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS resolutions ("
+            "key TEXT PRIMARY KEY, video_id TEXT, expires REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS resolutions_used ON resolutions (used)")
+        self._db.execute("DELETE FROM resolutions WHERE expires < ?", (time.time(),))
+        self._db.commit()
+        self._entries = self._db.execute("SELECT COUNT(*) FROM resolutions").fetchone()[0]
+
+    def get(self, key):
+        """
+        Look up a track. Returns a tuple (found, video_id), where
+        video_id is None for tracks that are known to be unavailable.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT video_id FROM resolutions WHERE key = ? AND expires >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return False, None
+            self._db.execute("UPDATE resolutions SET used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return True, row[0]
+
+    def put(self, key, video_id):
+        """Store the resolution of a track, video_id None means not found."""
+        now = time.time()
+        expires = now + (self.TTL if video_id is not None else self.NEGATIVE_TTL)
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM resolutions WHERE key = ?", (key,)).fetchone() is None:
+                self._entries += 1
+            self._db.execute("INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?)", (key, video_id, expires, now))
+            if self._entries > self.max_entries:
+                self._db.execute(
+                    "DELETE FROM resolutions WHERE key IN (SELECT key FROM resolutions ORDER BY used LIMIT ?)",
+                    (self._entries - self.max_entries,)
+                )
+                self._entries = self.max_entries
+            self._db.commit()
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._db.close()
+
+
+class JobStore:
+    """
+    Persistent queue of download jobs. A job is a single URL, a file of URLs
+    or a Spotify playlist, with the target directory and format to download
+    it in. Jobs that were running when the downloader stopped or crashed are
+    queued again when the store is opened, the download index of their
+    target lets them continue where they left off.
+    """
+    FILENAME = 'jobs.sqlite'
+    FIELDS = ('id', 'kind', 'source', 'name', 'target', 'format', 'state', 'total', 'counts', 'error')
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or os.path.join(cache_directory(), self.FILENAME), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, source TEXT NOT NULL, "
+            "name TEXT NOT NULL, target TEXT NOT NULL, format TEXT NOT NULL, state TEXT NOT NULL, "
+            "total INTEGER, counts TEXT NOT NULL, error TEXT)"
+        )
+        self._db.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'")
+        self._db.commit()
+
+    def add(self, kind, source, name, target, format, total=None):
+        """Queue a job, returns its id."""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (kind, source, name, target, format, state, total, counts) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, '{}')",
+                (kind, source, name, target, format, total)
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def jobs(self, where='1', parameters=()):
+        """Return the jobs matching a condition as dictionaries, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM jobs WHERE {where} ORDER BY id", parameters
+            ).fetchall()
+        jobs = [dict(zip(self.FIELDS, row)) for row in rows]
+        for job in jobs:
+            job['counts'] = json.loads(job['counts'])
+        return jobs
+
+    def claim(self):
+        """Mark the oldest queued job as running and return it, or None if no job is queued."""
+        with self._lock:
+            row = self._db.execute("SELECT id FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE jobs SET state = 'running', error = NULL WHERE id = ?", row)
+            self._db.commit()
+        return self.jobs("id = ?", row)[0]
+
+    def update(self, job_id, **fields):
+        """Update fields of a job, like its state, total or counts."""
+        if 'counts' in fields:
+            fields['counts'] = json.dumps(fields['counts'])
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                list(fields.values()) + [job_id]
+            )
+            self._db.commit()
+
+    def remove(self, job_id):
+        """Remove a job from the queue."""
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._db.commit()
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._db.close()
+
+
+class Broker:
+    """
+    Queue of videos shared by worker processes, on one or more hosts, in a
+    SQLite database they can all reach. Producers add video ids, workers
+    claim them in small batches and report how each one ended.
+
+    A video is processed at most once per format: it is queued once however
+    often it is added, and once a worker started it, it is not handed out
+    again, also when the worker crashed on it. Videos are 'claimed' by a
+    worker, 'running' when it started them, and 'done' or 'failed' at the
+    end. Claimed videos a worker did not start are released to the queue
+    again, and so are videos it was stopped or ran out of disk space for.
+    Failed videos stay failed until they are queued again with retry.
+    """
+    TIMEOUT = 60  # Seconds to wait for a lock held by another process
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=self.TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS videos ("
+            "video_id TEXT NOT NULL, format TEXT NOT NULL, state TEXT NOT NULL, worker TEXT, "
+            "claimed REAL, result TEXT, error TEXT, PRIMARY KEY (video_id, format))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS videos_state ON videos (state, format)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run the statements of the with block in a transaction that locks out the other processes."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def add(self, video_ids, format):
+        """Queue videos that were never added in this format. Returns the number of videos queued."""
+        with self._transaction() as db:
+            changes = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO videos (video_id, format, state) VALUES (?, ?, 'queued')",
+                [(video_id, format) for video_id in video_ids]
+            )
+            return db.total_changes - changes
+
+    def claim(self, worker, format, count):
+        """Mark at most count queued videos of a format as claimed by a worker, oldest first. Returns their ids."""
+        with self._transaction() as db:
+            rows = db.execute(
+                "SELECT video_id FROM videos WHERE state = 'queued' AND format = ? ORDER BY rowid LIMIT ?",
+                (format, count)
+            ).fetchall()
+            db.executemany(
+                "UPDATE videos SET state = 'claimed', worker = ?, claimed = ? WHERE video_id = ? AND format = ?",
+                [(worker, time.time(), video_id, format) for video_id, in rows]
+            )
+        return [video_id for video_id, in rows]
+
+    def start(self, video_id, format):
+        """Mark a claimed video as running, from now on it is not handed out again."""
+        with self._transaction() as db:
+            db.execute("UPDATE videos SET state = 'running' WHERE video_id = ? AND format = ?", (video_id, format))
+
+    def finish(self, video_id, format, result, error=None):
+        """Record how a claimed video ended: a download result like 'downloaded', or 'failed' with the error."""
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE videos SET state = ?, result = ?, error = ? WHERE video_id = ? AND format = ?",
+                ('failed' if error is not None else 'done', result, error, video_id, format)
+            )
+
+    def release(self, worker):
+        """Queue the videos a worker claimed but did not start again."""
+        with self._transaction() as db:
+            db.execute("UPDATE videos SET state = 'queued', worker = NULL, claimed = NULL "
+                       "WHERE state = 'claimed' AND worker = ?", (worker,))
+
+    def requeue(self, video_id, format):
+        """Queue a running video again, for a worker that stopped it without a result of the video itself."""
+        with self._transaction() as db:
+            db.execute("UPDATE videos SET state = 'queued', worker = NULL, claimed = NULL "
+                       "WHERE video_id = ? AND format = ?", (video_id, format))
+
+    def retry(self, format):
+        """Queue the failed videos of a format again. Returns their number."""
+        with self._transaction() as db:
+            return db.execute("UPDATE videos SET state = 'queued', error = NULL "
+                              "WHERE state = 'failed' AND format = ?", (format,)).rowcount
+
+    def counts(self, format):
+        """Return the number of videos of a format per state."""
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM videos WHERE format = ? GROUP BY state", (format,)))
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,148 @@
+# Youtube-downloader
+#
+# Distributed downloads: producers queue the videos of a URL file or a
+# Spotify playlist in a Broker, and any number of headless workers, in
+# processes on one host or on several hosts, download them from it.
+#
+# Copyright Philo Decroos
+# Apache 2.0 licence
+
+from engine import Downloader, DownloadCounter, read_urls, run_pool, youtube_video_id
+from network import DownloadCancelled
+from pipeline import SpotifyPipeline
+from scheduler import is_fatal
+from storage import ResolutionCache
+import itertools
+import os
+import socket
+import tempfile
+import time
+
+ADD_SIZE = 1000  # Videos added to the broker per transaction
+POLL_INTERVAL = 5  # Seconds a following worker waits when the queue is empty
+
+
+def worker_name():
+    """Name of the worker in this process, unique over the hosts that share a broker."""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class Worker:
+    """
+    Downloads the videos of a broker with a Downloader, until no video of
+    its format is queued, or until it is stopped when it follows the queue.
+
+    Videos are claimed twice as many as the downloader has workers at a
+    time, so a stopped worker only holds back a few. When it is stopped, the
+    videos it did not finish are released for other workers. Videos that
+    fail are recorded as failed with their error. Only fatal errors, like a
+    full disk, stop the worker: they release its videos and are raised.
+    """
+
+    def __init__(self, broker, downloader, follow=False, name=None):
+        self.broker = broker
+        self.downloader = downloader
+        self.format = downloader.policy.format
+        self.follow = follow
+        self.name = name or worker_name()
+        self.counter = DownloadCounter('downloaded', 'not_available', 'failed')
+
+    def run(self):
+        """Download claimed videos until the queue is empty or the worker is stopped. Returns the DownloadCounter."""
+        stopped = self.downloader.stopped
+        while not stopped():
+            video_ids = self.broker.claim(self.name, self.format, 2 * self.downloader.workers)
+            if not video_ids:
+                if not self.follow:
+                    break
+                for _ in range(POLL_INTERVAL):
+                    if stopped():
+                        break
+                    time.sleep(1)
+                continue
+            try:
+                run_pool(self.download, video_ids, self.downloader.workers, stopped)
+            finally:
+                self.broker.release(self.name)
+        return self.counter
+
+    def download(self, video_id):
+        """Download a claimed video and report the result to the broker, runs on the pool of the worker."""
+        self.broker.start(video_id, self.format)
+        try:
+            result = self.downloader.download_video(video_id)
+        except DownloadCancelled:
+            self.broker.requeue(video_id, self.format)
+            return
+        except Exception as error:
+            if is_fatal(error):
+                self.broker.requeue(video_id, self.format)
+                raise
+            self.downloader.failed(video_id, error)
+            self.broker.finish(video_id, self.format, 'failed', f"{type(error).__name__}: {error}")
+            result = 'failed'
+        else:
+            self.broker.finish(video_id, self.format, result)
+        self.downloader.bus.publish('counts', self.counter.add(result))
+
+
+def produce_urls(broker, urls, format):
+    """
+    Queue the videos of an iterable of YouTube URLs, like the lines of a file
+    read with read_urls. Returns a DownloadCounter of the videos that were
+    queued, that were queued before, and of the invalid URLs.
+    """
+    counter = DownloadCounter('queued', 'duplicate', 'invalid')
+    urls = iter(urls)
+    while True:
+        batch = list(itertools.islice(urls, ADD_SIZE))
+        if not batch:
+            return counter
+        video_ids = []
+        for url in batch:
+            video_id = youtube_video_id(url)
+            if video_id is None:
+                counter.add('invalid')
+            else:
+                video_ids.append(video_id)
+        queued = broker.add(video_ids, format)
+        counter.counts['queued'] += queued
+        counter.counts['duplicate'] += len(video_ids) - queued
+
+
+def produce_file(broker, filename, format):
+    """Queue the videos of a file with one YouTube URL per line. Returns a DownloadCounter, see produce_urls."""
+    return produce_urls(broker, read_urls(filename), format)
+
+
+class ProducerPipeline(SpotifyPipeline):
+    """
+    SpotifyPipeline that queues the matched videos of a playlist in a broker
+    instead of downloading them. Tracks are counted as 'downloaded' when
+    their video is queued.
+    """
+
+    def __init__(self, broker, downloader, spotify, playlist, resolutions):
+        super(ProducerPipeline, self).__init__(downloader, spotify, playlist, resolutions)
+        self.broker = broker
+
+    def fetch(self, video_id):
+        if video_id is not None:
+            self.broker.add([video_id], self.downloader.policy.format)
+        return video_id
+
+
+def produce_playlist(broker, spotify, playlist, include_video=False, workers=4, stopped=None, bus=None):
+    """
+    Find the tracks of a Spotify playlist on YouTube, like a playlist download
+    does, and queue the matched videos. Returns the DownloadCounter.
+    """
+    resolutions = ResolutionCache()
+    # The downloader is only used to search, so it gets a directory of its own
+    with tempfile.TemporaryDirectory() as target, Downloader(target, include_video, workers, stopped, bus) as downloader:
+        try:
+            pipeline = ProducerPipeline(broker, downloader, spotify, playlist, resolutions)
+            pipeline.run()
+        finally:
+            resolutions.close()
+    return pipeline.counter
@@ -6,583 +6,231 @@
 # Input sources can be single Youtube URLs, files containing multiple URLS
 # or Spotify Playlists.
 #
+# Without arguments the GUI is started. The batch, url and spotify commands
+# download without GUI, for use on servers or in cron jobs. With the produce
+# and worker commands, downloads are split over several worker processes or hosts.
+#
 # Copyright Philo Decroos
 # Apache 2.0 licence
 
-from moviepy.video.io.VideoFileClip import VideoFileClip
-from spotipy.oauth2 import SpotifyClientCredentials
-from tkinter import filedialog
-from urllib.parse import unquote
-from youtube_api import YouTubeDataAPI
-import magic
+from progress import ProgressBus, ProgressState
+import argparse
 import os
-import pytube
-import re
-import spotipy
+import signal
+import sys
 import threading
-import tkinter as tk
 
 
-class DownloadThread(threading.Thread):
+def parse_args(argv):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(prog='youtube_downloader', description="Download videos from YouTube as mp4 or mp3.")
+    commands = parser.add_subparsers(dest='command')
+
+    batch = commands.add_parser('batch', help="download all YouTube URLs listed in a file")
+    batch.add_argument('file', help="file with one YouTube URL per line")
+
+    url = commands.add_parser('url', help="download a single YouTube URL")
+    url.add_argument('url', help="YouTube URL")
+
+    spotify = commands.add_parser('spotify', help="download the songs of a Spotify playlist from YouTube")
+    spotify.add_argument('playlist', help="Spotify playlist id, URI or URL")
+
+    worker = commands.add_parser('worker', help="download the videos queued in a broker, next to other workers")
+    worker.add_argument('--follow', action='store_true', help="wait for new videos when the queue is empty, until stopped")
+
+    produce = commands.add_parser('produce', help="queue the videos of a file or a Spotify playlist in a broker, for workers")
+    produce.add_argument('kind', choices=('file', 'spotify'), help="kind of source")
+    produce.add_argument('source', help="file with one YouTube URL per line, or Spotify playlist id, URI or URL")
+    produce.add_argument('--retry', action='store_true', help="also queue the videos that failed before again")
+
+    status = commands.add_parser('status', help="show the number of videos in a broker per state")
+
+    for command in (worker, produce, status):
+        command.add_argument('--broker', required=True, metavar='PATH',
+                             help="SQLite database shared by the producers and workers, created if it does not exist")
+    for command in (produce, status):
+        command.add_argument('--format', choices=('mp3', 'mp4'), default='mp3', help="output format (default: mp3)")
+
+    for command in (batch, url, spotify, worker):
+        command.add_argument('--format', choices=('mp3', 'mp4'), default='mp3', help="output format (default: mp3)")
+        command.add_argument('--jobs', type=int, default=4, help="number of parallel downloads (default: 4)")
+        command.add_argument('--target', default=os.path.expanduser("~/Downloads"), help="target directory (default: ~/Downloads)")
+        command.add_argument('--backend', choices=('ffmpeg', 'moviepy'), default='ffmpeg',
+                             help="mp3 conversion: pipe downloads into ffmpeg, or convert finished files with moviepy (default: ffmpeg)")
+        command.add_argument('--max-resolution', type=int, default=1080, metavar='HEIGHT',
+                             help="highest video resolution to download, like 720 (default: 1080)")
+        command.add_argument('--codec', help="preferred codec, like avc1, vp9 or av01 for mp4 and mp4a or opus for mp3 downloads")
+        command.add_argument('--max-filesize', type=float, metavar='MB', help="skip streams larger than this")
+        command.add_argument('--progressive', action='store_true',
+                             help="only download streams with both video and audio, instead of separate streams muxed with ffmpeg")
+        command.add_argument('--metrics', metavar='PATH',
+                             help="write the time spent per stage and counters like bytes, retries and cache hits to a file, "
+                                  "in Prometheus text format for .prom and .txt files and JSON otherwise")
+        command.add_argument('--profile', metavar='PATH', help="profile the run with cProfile and write the stats to a file")
+
+    args = parser.parse_args(argv)
+    if args.command == 'batch' and not os.path.isfile(args.file):
+        parser.error(f"no such file: {args.file}")
+    if args.command == 'produce' and args.kind == 'file' and not os.path.isfile(args.source):
+        parser.error(f"no such file: {args.source}")
+    return args
+
+
+class ConsoleProgress(threading.Thread):
     """
-    Thread object used for downloading multiple videos in the background.
-    The stop method can be used to cancel the download.
+    Thread that prints the progress events of a download on a single line.
+    When stderr is not a terminal, like in a cron job, the events are only
+    drained, so logs only get the errors of failed items and the summary at the end.
     """
-    def __init__(self,  *args, **kwargs):
-        super(DownloadThread, self).__init__(*args, **kwargs)
-        self._stop_event = threading.Event()
-
-    def stop(self):
-        """Sends a stop signal to this thread."""
-        self._stop_event.set()
-
-    def stopped(self):
-        """Used by the thread to check for stop signal."""
-        return self._stop_event.is_set()
-
-
-class Page(tk.Frame):
-    """Base class for a GUI page. Contains methods that all pages need."""
-
-    def __init__(self, *args, **kwargs):
-        tk.Frame.__init__(self, *args, **kwargs)
-        self.youtube_regex = re.compile(r"^((?:https?:)?\/\/)?((?:www|m)\.)?((?:youtube\.com|youtu.be))(\/(?:[\w\-]+\?v=|embed\/|v\/)?)([\w\-]+)(\S+)?$")
-        self.download_thread = None
-
-    def convert_to_mp3(self, video_path):
-        """Convert an mp4 video to an mp3 audio file."""
-        if magic.from_file(video_path, mime=True) != 'video/mp4':
-            return
-
-        videoclip = VideoFileClip(video_path)
-        audioclip = videoclip.audio
-        audioclip.write_audiofile(video_path[:-1] + "3")
-        videoclip.close()
-        os.remove(video_path)
-
-    def clip_string(self, string):
-        """Clip long strings (file paths for example) so they don't mess up the GUI."""
-        return (string[:35] + '...') if len(string) > 35 else string
-
-    def download_in_progress(self):
-        """Check if a download thread is active on this page."""
-        return self.download_thread is not None and self.download_thread.isAlive()
-
-
-class SingleUrlPage(Page):
-    """Page in the GUI for downloading from a single URL."""
-
-    def __init__(self, *args, **kwargs):
-        Page.__init__(self, *args, **kwargs)
-        self.target = os.path.expanduser("~/Downloads")
-        self.include_video = tk.IntVar()
-        self.include_video.set(0)
-        self.make_widgets()
-
-    def make_widgets(self):
-        """Create the widgets that make up the page and position them."""
-        self.dir_label = tk.Label(self, text=self.clip_string("Target: " + self.target))
-        self.dir_label.grid(row=0, column=0, pady=20, padx=10)
-
-        self.dir_button = tk.Button(self, command=self.change_target, text="Choose directory")
-        self.dir_button.grid(row=0, column=1)
-
-        self.url_label = tk.Label(self, text="YouTube URL:")
-        self.url_label.grid(row=1, column=0, pady=20, padx=10)
-
-        self.url_entry = tk.Entry(self, width=40)
-        self.url_entry.grid(row=1, column=1)
-
-        self.video_checkbox = tk.Checkbutton(self, variable=self.include_video, onvalue=1, offvalue=0, text="Include video")
-        self.video_checkbox.grid(row=2, column=0, pady=20, padx=10)
-
-        self.submit_button = tk.Button(self, command=self.download, text="Download")
-        self.submit_button.grid(row=2, column=1)
-
-        self.status_label = tk.Label(self, text="")
-        self.status_label.grid(row=3, columnspan=2, pady=20, padx=10)
-
-    def download(self):
-        """
-        Downloads a youtube video from the url stored in url_entry.
-
-        Stores video in target location as mp4 or converts to mp3.
-        """
-        url = self.url_entry.get()
 
-        if not self.youtube_regex.match(url):
-            self.status_label.configure(text="URL is not a YouTube URL!", fg="red")
+    def __init__(self, bus):
+        super(ConsoleProgress, self).__init__(name="Progress", daemon=True)
+        self.bus = bus
+        self.state = ProgressState()
+        self.live = sys.stderr.isatty()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(0.5):
+            self.show()
+
+    def show(self):
+        """Apply the pending events and print the progress."""
+        for kind, value in self.bus.drain():
+            if kind == 'error':
+                print(f"\r{value:<60}" if self.live else value, file=sys.stderr)
+            self.state.apply(kind, value)
+        if not self.live:
             return
+        downloaded = self.state.counts.get('downloaded', 0)
+        print(f"\r{downloaded} downloaded, {self.state.describe()}   ", end='', file=sys.stderr, flush=True)
 
-        self.status_label.configure(text="Download in progress...", fg="green")
-        self.update()
-
-        youtube = pytube.YouTube(url)
-        video = youtube.streams.first()
-
-        if video is None:
-            self.status_label.configure(text="Sorry, this video is not \navailable for download.", fg="red")
-            return
-
-        path = video.download(self.target)
-        if self.include_video.get() == 0:
-            self.convert_to_mp3(path)
-
-        self.status_label.configure(text="Download complete!", fg="green")
-
-    def change_target(self):
-        """Changes the target directory (storage location)."""
-        directory = tk.filedialog.askdirectory()
-        if directory in [(), '']:
-            return  # User pressed cancel
-        self.target = directory
-        self.dir_label.configure(text=self.clip_string("Target: " + self.target))
-
-
-class FilePage(Page):
-    """Page in the GUI for downloading from a file containing Youtube URLs."""
-
-    def __init__(self, *args, **kwargs):
-        Page.__init__(self, *args, **kwargs)
-        self.target = os.path.expanduser("~/Downloads")
-        self.filename = "No file chosen"
-        self.include_video = tk.IntVar()
-        self.include_video.set(0)
-        self.make_widgets()
-
-    def make_widgets(self):
-        """Create the widgets that make up the page and position them."""
-        self.file_button = tk.Button(self, command=self.choose_file, text="Choose file")
-        self.file_button.grid(row=0, column=0, pady=20, padx=20)
-
-        self.file_label = tk.Label(self, text=self.clip_string(self.filename))
-        self.file_label.grid(row=0, column=1)
-
-        self.dir_button = tk.Button(self, command=self.change_target, text="Choose target directory")
-        self.dir_button.grid(row=1, column=0, pady=20, padx=20)
-
-        self.dir_label = tk.Label(self, text=self.clip_string(self.target))
-        self.dir_label.grid(row=1, column=1, pady=20, padx=20)
-
-        self.video_checkbox = tk.Checkbutton(self, variable=self.include_video, onvalue=1, offvalue=0, text="Include video")
-        self.video_checkbox.grid(row=2, column=0, pady=20, padx=20)
-
-        self.submit_button = tk.Button(self, command=self.start_download_thread, text="Download")
-        self.submit_button.grid(row=2, column=1)
-
-        self.cancel_button = tk.Button(self, command=self.cancel_download, text="Cancel")
-
-        self.error_label = tk.Label(self, text="", fg="red")
-        self.error_label.grid(row=3, column=0, pady=20, padx=10)
-
-        self.status_label = tk.Label(self, text="", fg="green")
-        self.status_label.grid(row=3, column=1, pady=20, padx=10)
-
-    def choose_file(self):
-        """Choose a file to use as input."""
-        filename = filedialog.askopenfilename()
-        if filename in [(), '']:
-            return  # User pressed cancel
-        self.filename = filename
-        self.file_label.configure(text=self.clip_string(self.filename))
-
-    def disable_gui(self):
-        """
-        Disable GUI elements that should not
-        be touched by user during a download.
-        """
-        self.video_checkbox.configure(state='disabled')
-        self.file_button.configure(state='disabled')
-        self.dir_button.configure(state='disabled')
-
-        self.cancel_button.grid(row=2, column=1)
-        self.submit_button.grid_forget()
-
-    def enable_gui(self):
-        """
-        Re-enable GUI elements that should not
-        be touched by user during a download.
-        """
-        self.video_checkbox.configure(state='normal')
-        self.file_button.configure(state='normal')
-        self.dir_button.configure(state='normal')
-
-        self.cancel_button.grid_forget()
-        self.cancel_button.configure(state='normal')
-        self.submit_button.grid(row=2, column=1)
-
-    def start_download_thread(self):
-        """Start a thread to do the downloading in the background."""
-        self.download_thread = DownloadThread(target=self.download, name="Downloader")
-        self.download_thread.start()
-
-    def cancel_download(self):
-        """
-        Send a stop signal to the download thread.
-        It will terminate and restore the GUI.
-        """
-        self.download_thread.stop()
-        self.cancel_button.configure(state='disabled')
-
-    def download(self):
-        """
-        Downloads all youtube videos from the urls listed in the given file.
-        Stores videos in target location as mp4 or converts to mp3.
-
-        Run this method as a DownloadThread.
-        """
-        thread = threading.current_thread()
-        if thread is None:
-            return
-
-        self.error_label.configure(text="")
-        self.update()
-
-        try:
-            urls_file = open(self.filename, "r").readlines()
-        except FileNotFoundError:
-            self.error_label.configure(text="File not found.")
-            return
-
-        if (len(urls_file) > 1000):
-            self.error_label.configure(text="File is too large.")
-            return
-
-        self.disable_gui()
-        downloaded = 0
-        invalid = 0
-        not_available = 0
-        cancelled = False
-        self.status_label.configure(text=f"{downloaded}/{len(urls_file)} downloaded...")
-        self.update()
-
-        for url in urls_file:
-            if thread.stopped():
-                cancelled = True
-                break
-
-            if not self.youtube_regex.match(url):
-                invalid += 1
-                continue
-
-            youtube = pytube.YouTube(url)
-            video = youtube.streams.first()
-            if video is None:
-                not_available += 1
-                continue
-
-            path = video.download(self.target)
-            if self.include_video.get() == 0:
-                self.convert_to_mp3(path)
-
-            downloaded += 1
-            self.status_label.configure(text=f"{downloaded}/{len(urls_file)} downloaded...")
-            self.update()
-
-        if invalid == 0 and not_available == 0:
-            self.status_label.configure(text="All downloads complete!")
+    def stop(self):
+        """Stop the thread and print the final progress."""
+        self._done.set()
+        self.join()
+        self.show()
+        if self.live:
+            print(file=sys.stderr)
+
+
+def produce(args, stopped):
+    """Queue the videos of a file or a playlist in a broker. Returns the exit status."""
+    from storage import Broker
+    from worker import produce_file, produce_playlist
+
+    broker = Broker(args.broker)
+    try:
+        if args.retry:
+            print(f"{broker.retry(args.format)} failed videos queued again.", file=sys.stderr)
+        if args.kind == 'file':
+            counter = produce_file(broker, args.source, args.format)
+            print(f"{counter['queued']} queued, {counter['duplicate']} queued before, {counter['invalid']} invalid.",
+                  file=sys.stderr)
         else:
-            if cancelled:
-                self.status_label.configure(text=f"Cancelled, {downloaded}/{len(urls_file)} downloaded.")
-            else:
-                self.status_label.configure(text=f"Complete, {downloaded}/{len(urls_file)} downloaded.")
-            self.error_label.configure(text=f"{invalid} URL's were invalid, \n{not_available} videos were not available \nfor download.")
-        self.enable_gui()
-
-    def change_target(self):
-        """Changes the target directory (storage location)."""
-        directory = tk.filedialog.askdirectory()
-        if directory in [(), '']:
-            return  # User pressed cancel
-        self.target = directory
-        self.dir_label.configure(text=self.clip_string(self.target))
-
-
-class SpotifyPage(Page):
-    """Page in the GUI for downloading from a Spotify playlist."""
-
-    def __init__(self, *args, **kwargs):
-        Page.__init__(self, *args, **kwargs)
-        self.spotify = spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials())
-        self.target = os.path.expanduser("~/Downloads")
-        self.include_video = tk.IntVar()
-        self.include_video.set(0)
-        self.playlist = {}
-        self.make_widgets()
-
-    def make_widgets(self):
-        """Create the widgets that make up the page and position them."""
-        self.disclaimer = tk.Label(
-            self,
-            text="Note: this tool downloads the songs from Youtube.\n" +
-                 "This will not work for every song and downloads can\n" +
-                 "be different from the Spotify songs."
-        )
-        self.disclaimer.grid(row=0, columnspan=2)
-
-        self.search_label = tk.Label(self, text="Search Spotify playlist:")
-        self.search_label.grid(row=1, column=0, pady=20, padx=10)
-
-        self.search_entry = tk.Entry(self, width=40)
-        self.search_entry.grid(row=1, column=1)
-
-        self.search_button = tk.Button(self, command=self.search_playlist, text="Search")
-        self.search_button.grid(row=2, column=0, pady=20, padx=20)
-
-        self.current_playlist = tk.Label(self, text="No playlist found")
-        self.current_playlist.grid(row=2, column=1)
-
-        self.dir_button = tk.Button(self, command=self.change_target, text="Choose target directory")
-        self.dir_button.grid(row=3, column=0, pady=20, padx=20)
-
-        self.dir_label = tk.Label(self, text=self.clip_string(self.target))
-        self.dir_label.grid(row=3, column=1, pady=20, padx=20)
-
-        self.video_checkbox = tk.Checkbutton(self, variable=self.include_video, onvalue=1, offvalue=0, text="Include video")
-        self.video_checkbox.grid(row=4, column=0, pady=20, padx=20)
-
-        self.submit_button = tk.Button(self, command=self.start_download_thread, text="Download")
-        self.submit_button.grid(row=4, column=1)
-
-        self.cancel_button = tk.Button(self, command=self.cancel_download, text="Cancel")
-
-        self.error_label = tk.Label(self, text="", fg="red")
-        self.error_label.grid(row=5, column=0, pady=20, padx=10)
-
-        self.status_label = tk.Label(self, text="", fg="green")
-        self.status_label.grid(row=5, column=1, pady=20, padx=10)
-
-    def disable_gui(self):
-        """
-        Disable GUI elements that should not
-        be touched by user during a download.
-        """
-        self.video_checkbox.configure(state='disabled')
-        self.search_button.configure(state='disabled')
-        self.dir_button.configure(state='disabled')
-
-        self.cancel_button.grid(row=4, column=1)
-        self.submit_button.grid_forget()
-
-    def enable_gui(self):
-        """
-        Re-enable GUI elements that should not
-        be touched by user during a download.
-        """
-        self.video_checkbox.configure(state='normal')
-        self.search_button.configure(state='normal')
-        self.dir_button.configure(state='normal')
-
-        self.cancel_button.grid_forget()
-        self.cancel_button.configure(state='normal')
-        self.submit_button.grid(row=4, column=1)
-
-    def start_download_thread(self):
-        """Start a thread to do the downloading in the background."""
-        self.download_thread = DownloadThread(target=self.download, name="Downloader")
-        self.download_thread.start()
-
-    def cancel_download(self):
-        """
-        Send a stop signal to the download thread.
-        It will terminate and restore the GUI.
-        """
-        self.download_thread.stop()
-        self.cancel_button.configure(state='disabled')
-
-    def search_playlist(self):
-        """Search for a Spotify playlist and display the name of the first match."""
-        term = self.search_entry.get()
-        if (term == ''):
-            self.current_playlist.configure(text='No playlist found')
-            self.playlist = {}
-            return
-
-        result = self.spotify.search(q=term, type='playlist', limit=1)
-
-        if len(result['playlists']['items']) == 0:
-            self.current_playlist.configure(text='No playlist found')
-            self.playlist = {}
-            return
-
-        self.playlist = result['playlists']['items'][0]
-        display = self.de_emojify(self.clip_string(self.playlist['owner']['display_name'] + ' - ' + self.playlist['name']))
-        self.current_playlist.configure(text=display)
-
-    def get_tracks(self, offset):
-        """
-        Get the next 100 tracks from the selected
-        playlist, starting from the offset.
-        """
-        if self.playlist == {}:
-            return
-
-        return self.spotify.playlist_items(
-            self.playlist['id'],
-            fields=('items(track(name,artists(name))),next'),
-            limit=100,
-            offset=offset,
-            additional_types=('track',)
-        )
-
-    def is_valid(self):
-        """Check for possible errors before starting the download."""
-        if self.playlist == {}:
-            self.error_label.configure(text="Please search a playlist first.")
-            self.update()
-            return False
-
-        length = self.playlist['tracks']['total']
-        if (length > 1000):
-            self.error_label.configure(text="The playlist cannot be \nlonger than 1000 songs.")
-            self.update()
-            return False
-
-        return True
-
-    def download(self):
-        """
-        Tries to find all songs from the selected Spotify
-        playlist on Youtube and downloads them.
-        Stores videos in target location as mp4 or converts to mp3.
-
-        Run this method as a DownloadThread.
-        """
-        thread = threading.current_thread()
-        if thread is None or not self.is_valid():
-            return
-
-        self.disable_gui()
-        self.error_label.configure(text="")
-        self.update()
-
-        length = self.playlist['tracks']['total']
-
-        offset = 0  # Spotify API is paginated, so we remember the offset
-        tracks = self.get_tracks(offset)
-
-        cancelled = False
-        downloaded = 0
-        not_found = 0
-        self.status_label.configure(text=f"{downloaded}/{length} downloaded...")
-        self.update()
-
-        while True:  # Loop over pages of Spotify API
-            for track in tracks['items']:
-                if thread.stopped():
-                    cancelled = True
-                    break
-
-                yt = YouTubeDataAPI(os.environ.get('YOUTUBE_API_KEY'))
-                artist = track['track']['artists'][0]['name']
-                track_name = track['track']['name']
-                searches = yt.search(q=f'{artist} {track_name}', max_results=5)
-                video = None
-                for result in searches:  # Look for first downloadable video in top 5 results
-                    video_title = unquote(result['video_title'].lower())  # Decode URL encoding
-                    if track_name.lower() not in video_title and not any(map(video_title.__contains__, ['ft', 'feat'])):
-                        continue  # Try to filter irrelevant search results
-
-                    video_id = result['video_id']
-                    youtube = pytube.YouTube(f'https://www.youtube.com/watch?v={video_id}')
-                    video = youtube.streams.first()
-                    if video:
-                        break
-
-                if video is None:
-                    not_found += 1
-                    continue
-
-                path = video.download(self.target)
-                if self.include_video.get() == 0:
-                    self.convert_to_mp3(path)
-
-                downloaded += 1
-                self.status_label.configure(text=f"{downloaded}/{length} downloaded...")
-                self.update()
-
-            offset += 100  # Increase offset and retrieve next page if it exists
-            if offset < length and tracks['next'] and not cancelled:
-                tracks = self.get_tracks(offset)
-            else:
-                break
-
-        if not_found == 0:
-            self.status_label.configure(text="All downloads complete!")
+            from engine import spotify_client
+
+            spotify = spotify_client()
+            playlist = spotify.playlist(args.source, fields='id,tracks(total)')
+            counter = produce_playlist(broker, spotify, playlist, args.format == 'mp4', stopped=stopped)
+            print(f"{counter['downloaded']} queued, {counter['not_found']} not found, {counter['failed']} failed.",
+                  file=sys.stderr)
+    finally:
+        broker.close()
+    return 1 if stopped() else 0
+
+
+def show_status(args):
+    """Print the number of videos in a broker per state. Returns the exit status."""
+    from storage import Broker
+
+    broker = Broker(args.broker)
+    try:
+        counts = broker.counts(args.format)
+    finally:
+        broker.close()
+    states = ('queued', 'claimed', 'running', 'done', 'failed')
+    print(', '.join(f"{counts.get(state, 0)} {state}" for state in states))
+    return 0
+
+
+def run(args, stopped):
+    """Run a command line download. Returns the exit status."""
+    from metrics import Profiler, metrics
+
+    profiler = Profiler() if args.profile else None
+    if profiler is not None:
+        profiler.start()
+
+    from engine import Downloader, FormatPolicy, read_urls, spotify_client
+
+    max_filesize = int(args.max_filesize * 1e6) if args.max_filesize else None
+    policy = FormatPolicy(args.format == 'mp4', args.max_resolution, args.codec, max_filesize, not args.progressive)
+    bus = ProgressBus()
+    try:
+        downloader = Downloader(args.target, args.format == 'mp4', args.jobs, stopped, bus, args.backend, policy=policy)
+    except OSError as error:
+        print(f"Cannot create the target directory {args.target}: {error.strerror}", file=sys.stderr)
+        return 1
+    console = ConsoleProgress(bus)
+    console.start()
+    try:
+        if args.command == 'batch':
+            counter = downloader.download_urls(read_urls(args.file))
+            failed = counter['invalid'] + counter['not_available'] + counter['failed']
+        elif args.command == 'url':
+            status = downloader.download_url(args.url)
+            counter = {'downloaded': int(status == 'downloaded')}
+            failed = int(status in ('invalid', 'not_available'))
+        elif args.command == 'worker':
+            from storage import Broker
+            from worker import Worker
+
+            broker = Broker(args.broker)
+            try:
+                counter = Worker(broker, downloader, args.follow).run()
+            finally:
+                broker.close()
+            failed = counter['not_available'] + counter['failed']
         else:
-            if cancelled:
-                self.status_label.configure(text=f"Cancelled, {downloaded}/{length} downloaded.")
-            else:
-                self.status_label.configure(text=f"Complete, {downloaded}/{length} downloaded.")
-            self.error_label.configure(text=f"{not_found} videos were not available \nfor download.")
-        self.enable_gui()
-
-    def change_target(self):
-        """Changes the target directory (storage location)."""
-        directory = tk.filedialog.askdirectory()
-        if directory in [(), '']:
-            return  # User pressed cancel
-        self.target = directory
-        self.dir_label.configure(text=self.clip_string(self.target))
-
-    def de_emojify(self, string):
-        """Remove emojis from a string."""
-        emoji_pattern = re.compile("["
-            u"\U0001F600-\U0001F64F"  # emoticons
-            u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-            u"\U0001F680-\U0001F6FF"  # transport & map symbols
-            u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-            "]+", flags=re.UNICODE)
-        return emoji_pattern.sub(r'', string)
-
-
-class YoutubeDownloader(tk.Frame):
-    """Main frame for the GUI, contains the two pages and navigation buttons."""
-
-    def __init__(self, *args, **kwargs):
-        tk.Frame.__init__(self, *args, **kwargs)
-
-        self.winfo_toplevel().title("Youtube Downloader")
-
-        self.p1 = SingleUrlPage(self)
-        self.p2 = FilePage(self)
-        self.p3 = SpotifyPage(self)
-
-        self.buttonframe = tk.Frame(self)
-        self.container = tk.Frame(self)
-        self.buttonframe.pack(side="top", fill="x", expand=False)
-        self.container.pack(side="top", fill="both", expand=True)
-
-        self.p1.place(in_=self.container, x=0, y=0, relwidth=1, relheight=1)
-        self.p2.place(in_=self.container, x=0, y=0, relwidth=1, relheight=1)
-        self.p3.place(in_=self.container, x=0, y=0, relwidth=1, relheight=1)
-
-        self.b1 = tk.Button(self.buttonframe, text="Single url", command=lambda: self.go_to_page(self.p1.lift))
-        self.b2 = tk.Button(self.buttonframe, text="From file", command=lambda: self.go_to_page(self.p2.lift))
-        self.b3 = tk.Button(self.buttonframe, text="From Spotify", command=lambda: self.go_to_page(self.p3.lift))
-
-        self.b1.pack(side="left")
-        self.b2.pack(side="left")
-        self.b3.pack(side="left")
-        self.p1.lift()
-
-    def go_to_page(self, command):
-        """
-        Execute the given function (switch to page),
-        but only if a download is not in progress.
-        """
-        if not self.download_in_progress():
-            command()
-
-    def download_in_progress(self):
-        """Check if a download is in progress in one of the pages."""
-        return (self.p1.download_in_progress() or
-                self.p2.download_in_progress() or
-                self.p3.download_in_progress())
+            spotify = spotify_client()
+            playlist = spotify.playlist(args.playlist, fields='id,tracks(total)')
+            counter = downloader.download_playlist(spotify, playlist)
+            failed = counter['not_found'] + counter['failed']
+    finally:
+        downloader.close()
+        console.stop()
+        if profiler is not None:
+            profiler.stop()
+            profiler.dump(args.profile)
+        if args.metrics:
+            metrics.write(args.metrics)
+
+    print(f"{counter['downloaded']} downloaded, {failed} failed.", file=sys.stderr)
+    return 1 if failed or stopped() else 0
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.command is None:
+        import gui
+        gui.main()
+        return 0
+    if args.command == 'status':
+        return show_status(args)
+
+    # The first Ctrl+C lets running downloads stop cleanly, a second one exits immediately
+    stop_event = threading.Event()
+
+    def interrupt(signum, frame):
+        stop_event.set()
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    signal.signal(signal.SIGINT, interrupt)
+    if args.command == 'produce':
+        return produce(args, stop_event.is_set)
+    return run(args, stop_event.is_set)
+
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    downloader = YoutubeDownloader(root)
-    downloader.pack(side="top", fill="both", expand=True)
-    root.wm_geometry("650x450")
-    root.mainloop()
+    sys.exit(main())